@@ -20,13 +20,14 @@ class RegistrationForm(FlaskForm):
     submit = SubmitField('Register')
 
     def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
-        if user is not None:
+        # Existence check only; fetch just the id instead of hydrating the row
+        taken = User.query.with_entities(User.id).filter_by(username=username.data).first()
+        if taken is not None:
             raise ValidationError('Please use a different username.')
 
     def validate_email(self, email):
-        user = User.query.filter_by(email=email.data).first()
-        if user is not None:
+        taken = User.query.with_entities(User.id).filter_by(email=email.data).first()
+        if taken is not None:
             raise ValidationError('Please use a different email address.')
 
     def validate_password(self, password):
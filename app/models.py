@@ -13,6 +13,10 @@ class Role(db.Model):
     def __repr__(self):
         return f'<Role {self.name}>'
 
+def load_roles():
+    """Load all roles in one query as a {name: Role} dict"""
+    return {role.name: role for role in Role.query.all()}
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -73,6 +77,14 @@ class PaymentData(db.Model):
     sheet_category = db.Column(db.String(50))  # M2p Deposit, Settlement Deposit, etc.
     upload_timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Report aggregates filter on user + category + date range
+    __table_args__ = (
+        db.Index('ix_payment_user_cat_created', 'user_id', 'sheet_category', 'created'),
+        # Backs the bulk existence checks and plain date-range filters
+        db.Index('ix_payment_user_tx', 'user_id', 'tx_id'),
+        db.Index('ix_payment_user_created', 'user_id', 'created'),
+    )
+
 class IBRebate(db.Model):
     __tablename__ = 'ib_rebate'
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -82,6 +94,11 @@ class IBRebate(db.Model):
     rebate_time = db.Column(db.DateTime)
     upload_timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_rebate_user_time', 'user_id', 'rebate_time'),
+        db.Index('ix_rebate_user_tx', 'user_id', 'transaction_id'),
+    )
+
 class CRMWithdrawals(db.Model):
     __tablename__ = 'crm_withdrawals'
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -92,6 +109,11 @@ class CRMWithdrawals(db.Model):
     withdrawal_amount = db.Column(db.Float)
     upload_timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_crm_wd_user_time', 'user_id', 'review_time'),
+        db.Index('ix_crm_wd_user_request', 'user_id', 'request_id'),
+    )
+
 class CRMDeposit(db.Model):
     __tablename__ = 'crm_deposit'
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -105,6 +127,11 @@ class CRMDeposit(db.Model):
     name = db.Column(db.String(200))
     upload_timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_crm_dep_user_time', 'user_id', 'request_time'),
+        db.Index('ix_crm_dep_user_request', 'user_id', 'request_id'),
+    )
+
 class AccountList(db.Model):
     __tablename__ = 'account_list'
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
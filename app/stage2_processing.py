@@ -1,23 +1,61 @@
+import os
 import pandas as pd
 import numpy as np
+import charset_normalizer
 from datetime import datetime, timedelta
+from functools import lru_cache
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from app import db
 from app.models import PaymentData, IBRebate, CRMWithdrawals, CRMDeposit, AccountList, UploadedFiles
+from app.stage2_reports_enhanced import invalidate_report_cache
 from flask_login import current_user
 import uuid
 import re
 import logging
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Set up logging; configuring handlers/levels is left to the application
 logger = logging.getLogger(__name__)
 
-def detect_separator(line):
-    """Detect CSV separator based on character count"""
-    tab_count = line.count('\t')
-    comma_count = line.count(',')
-    semicolon_count = line.count(';')
+# Compiled once at import time; re.sub per cell would re-do the pattern
+# cache lookup on every call
+_NON_NUMERIC_RE = re.compile(r'[^0-9.-]')
+
+def safe_str(value, default=''):
+    """Convert a cell value to str, fast-pathing values that need no work"""
+    if value is None:
+        return default
+    if type(value) is str:
+        return value
+    # NaN from empty spreadsheet cells should read as missing, not 'nan'
+    if isinstance(value, float) and value != value:
+        return default
+    return str(value)
+
+def safe_float(value, default=0.0):
+    """Convert a cell value to float, stripping currency text if needed"""
+    # Exact-type checks first: the common clean cells skip both the
+    # isinstance machinery and the regex below
+    t = type(value)
+    if t is float:
+        return default if value != value else value
+    if t is int:
+        return float(value)
+    if isinstance(value, (np.integer, np.floating)):
+        return default if pd.isna(value) else float(value)
+
+    cleaned = _NON_NUMERIC_RE.sub('', str(value or ''))
+    try:
+        return float(cleaned) if cleaned else default
+    except ValueError:
+        return default
+
+def detect_separator(sample):
+    """Detect CSV separator based on character count in a text sample"""
+    tab_count = sample.count('\t')
+    comma_count = sample.count(',')
+    semicolon_count = sample.count(';')
     
     logger.info(f"Separator detection - Tab: {tab_count}, Comma: {comma_count}, Semicolon: {semicolon_count}")
     
@@ -27,34 +65,65 @@ def detect_separator(line):
         return ';'
     return ','
 
+# Supported date formats, tried in order
+_DATE_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d',
+    '%d.%m.%Y %H:%M:%S',
+    '%d.%m.%Y',
+    '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y'
+]
+
 def parse_date_flexible(date_str):
     """Parse dates in various formats"""
     if pd.isna(date_str) or not date_str:
         return None
-    
+
     date_str = str(date_str).strip()
-    
-    # Try different date formats
-    formats = [
-        '%Y-%m-%d %H:%M:%S',
-        '%Y-%m-%d',
-        '%d.%m.%Y %H:%M:%S',
-        '%d.%m.%Y',
-        '%d/%m/%Y %H:%M:%S',
-        '%d/%m/%Y',
-        '%m/%d/%Y %H:%M:%S',
-        '%m/%d/%Y'
-    ]
-    
-    for fmt in formats:
+
+    for fmt in _DATE_FORMATS:
         try:
             return datetime.strptime(date_str, fmt)
         except ValueError:
             continue
-    
+
     logger.warning(f"Could not parse date: {date_str}")
     return None
 
+def parse_date_series(series):
+    """
+    Parse a whole date column at once with pandas' cached C parser
+    Vectorized replacement for calling parse_date_flexible per row: each
+    supported format is tried column-wise against the still-unparsed
+    cells, preserving the same trial order. Returns a list of datetimes
+    with None for unparseable cells.
+    """
+    values = series.astype(str).str.strip()
+    result = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+
+    for fmt in _DATE_FORMATS:
+        mask = result.isna()
+        if not mask.any():
+            break
+        result.loc[mask] = pd.to_datetime(values[mask], format=fmt, errors='coerce', cache=True)
+
+    return [value.to_pydatetime() if value is not pd.NaT else None for value in result]
+
+@lru_cache(maxsize=64)
+def _normalized_header_map(headers):
+    """
+    Map normalized (stripped, upper-cased) header -> first index
+    Cached per header tuple so the several find_column_index calls made
+    for one file normalize the headers only once.
+    """
+    normalized = {}
+    for i, header in enumerate(headers):
+        normalized.setdefault(str(header).strip().upper(), i)
+    return normalized
+
 def find_column_index(headers, search_terms, exact_match=None):
     """
     Find column index by searching for terms in headers
@@ -63,67 +132,203 @@ def find_column_index(headers, search_terms, exact_match=None):
         search_terms: List of terms to search for (case insensitive)
         exact_match: If provided, look for exact match first
     """
+    normalized = _normalized_header_map(tuple(str(h) for h in headers))
+
     # First try exact match if provided
     if exact_match:
-        for i, header in enumerate(headers):
-            if header.strip().upper() == exact_match.upper():
-                logger.info(f"Found exact match '{exact_match}' at index {i}")
-                return i
-    
-    # Then try partial matches
-    for i, header in enumerate(headers):
-        header_upper = header.strip().upper()
-        for term in search_terms:
-            if term.upper() in header_upper:
-                logger.info(f"Found '{term}' in '{header}' at index {i}")
-                return i
-    
+        index = normalized.get(exact_match.upper())
+        if index is not None:
+            logger.debug("Found exact match '%s' at index %d", exact_match, index)
+            return index
+
+    # Then try partial matches, preserving header order
+    terms_upper = [term.upper() for term in search_terms]
+    for header_upper, index in normalized.items():
+        for term in terms_upper:
+            if term in header_upper:
+                logger.debug("Found '%s' in '%s' at index %d", term, headers[index], index)
+                return index
+
     return None
 
+# Sniff results cached per upload, since the same file is often read
+# twice (existence check + processing)
+_SNIFF_CACHE = {}
+_SNIFF_CACHE_MAX = 32
+
+def detect_encoding_and_sample(file_path, chunk_size=16384, max_bytes=131072):
+    """
+    Detect file encoding by feeding bytes to the detector incrementally
+    Reads one chunk at a time and stops as soon as the detector is
+    confident, so large files never need a full scan. Returns the
+    encoding plus the raw sample so callers can sniff the separator from
+    it without another read.
+    """
+    stat = os.stat(file_path)
+    cache_key = (file_path, stat.st_size, stat.st_mtime)
+    if cache_key in _SNIFF_CACHE:
+        return _SNIFF_CACHE[cache_key]
+
+    sample = b''
+    encoding = 'utf-8'
+    best = None
+
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sample += chunk
+
+            if sample.startswith(b'\xef\xbb\xbf'):
+                encoding = 'utf-8-sig'
+                best = None
+                break
+
+            best = charset_normalizer.from_bytes(sample).best()
+            if (best is not None and best.chaos <= 0.05) or len(sample) >= max_bytes:
+                break
+
+    if best is not None:
+        encoding = best.encoding
+    # An ASCII-only sample says nothing about bytes beyond it; utf-8 is
+    # a strict superset, so promoting the detection costs nothing and
+    # keeps a multibyte character later in the file from derailing the
+    # full parse
+    if encoding == 'ascii':
+        encoding = 'utf-8'
+
+    if len(_SNIFF_CACHE) >= _SNIFF_CACHE_MAX:
+        _SNIFF_CACHE.clear()
+    _SNIFF_CACHE[cache_key] = (encoding, sample)
+    return encoding, sample
+
 def read_file_with_encoding(file_path, file_format='csv'):
     """Read file with proper encoding detection"""
     if file_format.lower() == 'xlsx':
         logger.info("Reading XLSX file")
         return pd.read_excel(file_path)
-    
-    # Try different encodings for CSV
-    encodings = ['utf-8', 'utf-8-sig', 'latin1', 'cp1252', 'iso-8859-1']
-    
-    for encoding in encodings:
-        try:
-            logger.info(f"Trying encoding: {encoding}")
-            with open(file_path, 'r', encoding=encoding) as f:
-                first_line = f.readline()
-                separator = detect_separator(first_line)
-            
-            data = pd.read_csv(file_path, sep=separator, encoding=encoding)
-            logger.info(f"Successfully read file with {encoding} encoding and '{separator}' separator")
-            return data
-            
-        except (UnicodeDecodeError, pd.errors.EmptyDataError) as e:
-            logger.warning(f"Failed to read with {encoding}: {e}")
-            continue
-    
-    raise ValueError("Could not read file with any supported encoding")
+
+    # Sniff encoding and separator from a bounded sample, then parse the
+    # file once with the C engine instead of retrying whole-file reads
+    # for every candidate encoding
+    encoding, sample = detect_encoding_and_sample(file_path)
+
+    if not sample:
+        raise ValueError("File is empty or invalid")
+
+    # Count separator candidates over the first 8KB of decoded text, not
+    # just the first line, so a missing or odd header line cannot skew
+    # the detection
+    text_sample = sample.decode(encoding, errors='replace')[:8192]
+    separator = detect_separator(text_sample)
+
+    # MetaTrader account exports put a description line right after the
+    # header; detect it in the raw sample and drop it at parse time so
+    # the processor never has to copy the DataFrame with iloc[1:]
+    sample_lines = text_sample.split('\n')
+    skiprows = [1] if len(sample_lines) > 1 and 'METATRADER' in sample_lines[1].upper() else None
+
+    try:
+        data = pd.read_csv(file_path, sep=separator, encoding=encoding, skiprows=skiprows,
+                           engine='c', low_memory=False, dtype=str, na_filter=False)
+    except (UnicodeDecodeError, ValueError):
+        # The sample can miss unusual bytes later in the file; retry as
+        # utf-8 before latin1, which accepts any byte sequence but turns
+        # multibyte characters into mojibake
+        fallbacks = ['latin1'] if encoding == 'utf-8' else ['utf-8', 'latin1']
+        for fallback in fallbacks:
+            logger.warning(f"Decoding with {encoding} failed, falling back to {fallback}")
+            encoding = fallback
+            try:
+                data = pd.read_csv(file_path, sep=separator, encoding=encoding, skiprows=skiprows,
+                                   engine='c', low_memory=False, dtype=str, na_filter=False)
+                break
+            except (UnicodeDecodeError, ValueError):
+                if fallback == 'latin1':
+                    raise
+
+    logger.info(f"Successfully read file with {encoding} encoding and '{separator}' separator")
+    return data
+
+def load_existing_keys(column, candidate_keys, chunk_size=5000):
+    """
+    Load the set of keys that already exist in the database
+    Args:
+        column: Model column to query (e.g. PaymentData.tx_id)
+        candidate_keys: Iterable of keys found in the uploaded file
+        chunk_size: Maximum number of keys per IN clause
+    Returns a set of keys, so the row loop can do membership tests in
+    memory instead of one SELECT per row.
+    """
+    keys = [k for k in candidate_keys if k]
+    existing = set()
+
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        existing.update(value for (value,) in db.session.query(column).filter(column.in_(chunk)))
+
+    logger.info(f"Prefetched {len(existing)} existing keys out of {len(keys)} candidates")
+    return existing
+
+def _insert_ignoring_duplicates(model):
+    """
+    Build an INSERT that lets the database skip duplicate keys atomically
+    Where the dialect supports it, ON CONFLICT DO NOTHING (or INSERT
+    IGNORE on MySQL) folds the uniqueness check into the index insert
+    itself, closing the race left open by check-then-insert. Returns
+    None when the dialect offers no such clause.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return sqlite_insert(model.__table__).on_conflict_do_nothing()
+    if dialect == 'postgresql':
+        return pg_insert(model.__table__).on_conflict_do_nothing()
+    if dialect == 'mysql':
+        return model.__table__.insert().prefix_with('IGNORE')
+    return None
+
+def bulk_insert_records(model, records, chunk_size=1000):
+    """
+    Insert a list of row mappings in batches
+    One multi-row statement per chunk amortizes statement parsing and
+    flush overhead compared to per-row db.session.add() calls. Duplicate
+    keys are ignored by the database where the dialect allows it.
+    Returns the number of rows the database actually inserted, so
+    callers can reconcile their counts against conflict-dropped rows.
+    """
+    if not records:
+        return 0
+    stmt = _insert_ignoring_duplicates(model)
+    if stmt is None:
+        # Core executemany: the driver batches each chunk into one
+        # round-trip even on dialects without a conflict clause
+        stmt = model.__table__.insert()
+    inserted = 0
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        result = db.session.execute(stmt, chunk)
+        # Drivers that cannot report executemany rowcounts return -1
+        inserted += result.rowcount if result.rowcount >= 0 else len(chunk)
+    return inserted
 
 def filter_unique_rows(existing_keys, new_rows, key_columns, data_headers):
-    """Filter out duplicate rows based on key columns"""
+    """
+    Filter out duplicate rows based on key columns
+    Keys are plain tuples hashed directly into the set; building and
+    joining an intermediate list per row costs an extra allocation and
+    a string concatenation for nothing.
+    """
     unique_rows = []
-    
+
     for row in new_rows:
-        # Create key from specified columns
-        key_parts = []
-        for idx in key_columns:
-            if idx < len(row):
-                val = str(row[idx] or '').strip().upper()
-                key_parts.append(val)
-        
-        key = '|'.join(key_parts)
-        
-        if key and key not in existing_keys:
+        key = tuple(safe_str(row[idx]).strip().upper()
+                    for idx in key_columns if idx < len(row))
+
+        if any(key) and key not in existing_keys:
             existing_keys.add(key)
             unique_rows.append(row)
-    
+
     return unique_rows
 
 def process_payment_data(file_path, file_format='csv'):
@@ -135,13 +340,14 @@ def process_payment_data(file_path, file_format='csv'):
         
         if data.empty or len(data) < 1:
             raise ValueError("File is empty or invalid")
-        
+
+        data.columns = data.columns.str.strip()
         headers = data.columns.tolist()
-        rows = data.values.tolist()
-        
-        logger.info(f"File has {len(rows)} rows and {len(headers)} columns")
+        total_rows = len(data)
+
+        logger.info(f"File has {total_rows} rows and {len(headers)} columns")
         logger.info(f"Headers: {headers}")
-        
+
         # Define column mapping
         column_map = {
             'confirmed': 'Confirmed',
@@ -164,92 +370,129 @@ def process_payment_data(file_path, file_format='csv'):
             'tier_fee': 'Tier fee'
         }
         
-        added_count = 0
         skipped_count = 0
-        
-        for i, row in enumerate(rows):
-            try:
-                # Create row dictionary
-                row_dict = {}
-                for j, header in enumerate(headers):
-                    if j < len(row):
-                        row_dict[header.strip()] = row[j]
+
+        # Vectorized pre-filter: drop rows the loop would skip anyway
+        # (no transaction ID, BALANCE gateway, status not DONE)
+        tx_id_col = column_map['tx_id']
+        status_col = column_map['status']
+        pg_col = column_map['payment_gateway']
+        if all(col in data.columns for col in (tx_id_col, status_col, pg_col)):
+            mask = (data[tx_id_col].astype(str).str.strip().ne('') &
+                    data[status_col].astype(str).str.upper().eq('DONE') &
+                    data[pg_col].astype(str).str.upper().ne('BALANCE'))
+            skipped_count = int((~mask).sum())
+            if skipped_count:
+                logger.info(f"Pre-filtered {skipped_count} rows (empty tx id, BALANCE gateway or status not DONE)")
+            data = data[mask]
+
+        # Resolve every mapped column to a plain list once, instead of
+        # rebuilding a header -> value dict for every row
+        n = len(data)
+        cols = {}
+        for key, header in column_map.items():
+            cols[key] = data[header].tolist() if header in data.columns else [''] * n
+
+        tx_ids = [str(v).strip() for v in cols['tx_id']]
+        statuses = [str(v).upper() for v in cols['status']]
+        pg_names = [str(v).upper() for v in cols['payment_gateway']]
+        tx_types = [str(v).upper() for v in cols['type']]
+
+        # Classify sheet categories in one numpy pass instead of string
+        # comparisons per row
+        is_settlement = np.char.find(np.asarray(pg_names, dtype=str), 'SETTLEMENT') >= 0
+        is_deposit = np.asarray(tx_types, dtype=str) == 'DEPOSIT'
+        sheet_categories = np.where(
+            is_deposit,
+            np.where(is_settlement, 'Settlement Deposit', 'M2p Deposit'),
+            np.where(is_settlement, 'Settlement Withdraw', 'M2p Withdraw')
+        ).tolist()
+
+        # Prefetch existing transaction IDs in one query instead of one per row
+        existing_tx_ids = load_existing_keys(PaymentData.tx_id, set(tx_ids))
+
+        # Parse the Booked column in one vectorized pass
+        created_col = column_map['created']
+        created_dates = parse_date_series(data[created_col]) if created_col in data.columns else [None] * len(data)
+
+        # Read the LocalProxy once; each access walks the request context
+        uid = current_user.id
+        added_count = 0
+        records = []
+        seen_in_file = set()
+
+        # Guard against autoflush scanning the session on any query that
+        # fires while records are pending
+        with db.session.no_autoflush:
+            for i in range(n):
+                try:
+                    tx_id = tx_ids[i]
+                    status = statuses[i]
+                    pg_name = pg_names[i]
+                    tx_type = tx_types[i]
+
+                    logger.debug("Row %d: tx_id='%s', status='%s', pg_name='%s', type='%s'", i+1, tx_id, status, pg_name, tx_type)
                 
-                # Extract values
-                tx_id = str(row_dict.get(column_map.get('tx_id', ''), '')).strip()
-                status = str(row_dict.get(column_map.get('status', ''), '')).upper()
-                pg_name = str(row_dict.get(column_map.get('payment_gateway', ''), '')).upper()
-                tx_type = str(row_dict.get(column_map.get('type', ''), '')).upper()
+                    if not tx_id:
+                        logger.debug("Row %d: Skipped - No transaction ID", i+1)
+                        skipped_count += 1
+                        continue
                 
-                logger.info(f"Row {i+1}: tx_id='{tx_id}', status='{status}', pg_name='{pg_name}', type='{tx_type}'")
+                    if pg_name == 'BALANCE':
+                        logger.debug("Row %d: Skipped - Payment gateway is BALANCE", i+1)
+                        skipped_count += 1
+                        continue
                 
-                if not tx_id:
-                    logger.warning(f"Row {i+1}: Skipped - No transaction ID")
-                    skipped_count += 1
-                    continue
+                    if status != 'DONE':
+                        logger.debug("Row %d: Skipped - Status is not DONE (status: %s)", i+1, status)
+                        skipped_count += 1
+                        continue
                 
-                if pg_name == 'BALANCE':
-                    logger.info(f"Row {i+1}: Skipped - Payment gateway is BALANCE")
-                    skipped_count += 1
-                    continue
+                    # Check if already exists (in this file or in the database)
+                    if tx_id in seen_in_file or tx_id in existing_tx_ids:
+                        logger.debug("Row %d: Skipped - Transaction ID %s already exists", i+1, tx_id)
+                        skipped_count += 1
+                        continue
                 
-                if status != 'DONE':
-                    logger.info(f"Row {i+1}: Skipped - Status is not DONE (status: {status})")
-                    skipped_count += 1
-                    continue
+                    # Build new payment record mapping for the bulk insert
+                    records.append(dict(
+                        user_id=uid,
+                        confirmed=cols['confirmed'][i],
+                        tx_id=tx_id,
+                        wallet_address=cols['wallet_address'][i],
+                        status=status,
+                        type=tx_type,
+                        payment_gateway=cols['payment_gateway'][i],
+                        final_amount=float(cols['final_amount'][i] or 0),
+                        final_currency=cols['final_currency'][i],
+                        settlement_amount=float(cols['settlement_amount'][i] or 0),
+                        settlement_currency=cols['settlement_currency'][i],
+                        processing_fee=float(cols['processing_fee'][i] or 0),
+                        price=float(cols['price'][i] or 1),
+                        comment=cols['comment'][i],
+                        payment_id=cols['payment_id'][i],
+                        created=created_dates[i],
+                        trading_account=cols['trading_account'][i],
+                        correct_coin_sent=True,
+                        balance_after=float(cols['balance_after'][i] or 0),
+                        tier_fee=float(cols['tier_fee'][i] or 0),
+                        sheet_category=sheet_categories[i]
+                    ))
+                    seen_in_file.add(tx_id)
+                    logger.debug("Row %d: Added payment record for transaction %s", i+1, tx_id)
+                    added_count += 1
                 
-                # Check if already exists
-                existing = PaymentData.query.filter_by(tx_id=tx_id).first()
-                if existing:
-                    logger.info(f"Row {i+1}: Skipped - Transaction ID {tx_id} already exists in database")
+                except Exception as e:
+                    logger.error(f"Row {i+1}: Error processing - {e}")
                     skipped_count += 1
                     continue
-                
-                # Determine sheet category
-                sheet_category = ''
-                if tx_type == 'DEPOSIT':
-                    sheet_category = 'Settlement Deposit' if 'SETTLEMENT' in pg_name else 'M2p Deposit'
-                else:
-                    sheet_category = 'Settlement Withdraw' if 'SETTLEMENT' in pg_name else 'M2p Withdraw'
-                
-                # Create new payment record
-                payment = PaymentData(
-                    user_id=current_user.id,
-                    confirmed=row_dict.get(column_map.get('confirmed', '')),
-                    tx_id=tx_id,
-                    wallet_address=row_dict.get(column_map.get('wallet_address', '')),
-                    status=status,
-                    type=tx_type,
-                    payment_gateway=row_dict.get(column_map.get('payment_gateway', '')),
-                    final_amount=float(row_dict.get(column_map.get('final_amount', ''), 0) or 0),
-                    final_currency=row_dict.get(column_map.get('final_currency', '')),
-                    settlement_amount=float(row_dict.get(column_map.get('settlement_amount', ''), 0) or 0),
-                    settlement_currency=row_dict.get(column_map.get('settlement_currency', '')),
-                    processing_fee=float(row_dict.get(column_map.get('processing_fee', ''), 0) or 0),
-                    price=float(row_dict.get(column_map.get('price', ''), 1) or 1),
-                    comment=row_dict.get(column_map.get('comment', '')),
-                    payment_id=row_dict.get(column_map.get('payment_id', '')),
-                    created=parse_date_flexible(row_dict.get(column_map.get('created', ''))),
-                    trading_account=row_dict.get(column_map.get('trading_account', '')),
-                    correct_coin_sent=True,
-                    balance_after=float(row_dict.get(column_map.get('balance_after', ''), 0) or 0),
-                    tier_fee=float(row_dict.get(column_map.get('tier_fee', ''), 0) or 0),
-                    sheet_category=sheet_category
-                )
-                
-                db.session.add(payment)
-                logger.info(f"Row {i+1}: Added payment record for transaction {tx_id}")
-                added_count += 1
-                
-            except Exception as e:
-                logger.error(f"Row {i+1}: Error processing - {e}")
-                skipped_count += 1
-                continue
-        
+
+        bulk_insert_records(PaymentData, records)
         db.session.commit()
-        logger.info(f"Processing complete: {added_count} added, {skipped_count} skipped")
-        return {'added_rows': added_count, 'total_rows': len(rows), 'skipped_rows': skipped_count}
-        
+        invalidate_report_cache(uid)
+        logger.info("Processing complete: %d added, %d skipped", added_count, skipped_count)
+        return {'added_rows': added_count, 'total_rows': total_rows, 'skipped_rows': skipped_count}
+
     except Exception as e:
         logger.error(f"Fatal error processing payment data: {e}")
         db.session.rollback()
@@ -266,11 +509,11 @@ def process_ib_rebate(file_path, file_format='csv'):
             raise ValueError("File is empty or invalid")
         
         headers = data.columns.tolist()
-        rows = data.values.tolist()
-        
-        logger.info(f"File has {len(rows)} rows and {len(headers)} columns")
+        total_rows = len(data)
+
+        logger.info(f"File has {total_rows} rows and {len(headers)} columns")
         logger.info(f"Headers: {headers}")
-        
+
         # Find required columns with improved logic
         tx_id_idx = find_column_index(headers, ['Transaction ID', 'TRANSACTION_ID'], 'Transaction ID')
         rebate_idx = find_column_index(headers, ['Rebate'], 'Rebate')
@@ -282,57 +525,74 @@ def process_ib_rebate(file_path, file_format='csv'):
             raise ValueError("Transaction ID column not found")
         if rebate_time_idx is None:
             raise ValueError("Rebate Time column not found")
-        
+
+        # Prefetch existing transaction IDs in one query instead of one per row
+        candidate_ids = {safe_str(v).strip() for v in data.iloc[:, tx_id_idx].tolist()}
+        existing_tx_ids = load_existing_keys(IBRebate.transaction_id, candidate_ids)
+
+        # Parse the Rebate Time column in one vectorized pass
+        rebate_times = parse_date_series(data.iloc[:, rebate_time_idx])
+
+        # Convert rebate values in one contiguous float64 pass instead of
+        # per-row float() calls
+        if rebate_idx is not None:
+            rebate_vals = pd.to_numeric(data.iloc[:, rebate_idx], errors='coerce').fillna(0.0).astype(np.float64).tolist()
+        else:
+            rebate_vals = [0.0] * len(data)
+
+        # Read the LocalProxy once; each access walks the request context
+        uid = current_user.id
         added_count = 0
         skipped_count = 0
-        
-        for i, row in enumerate(rows):
-            try:
-                if len(row) <= tx_id_idx:
-                    logger.warning(f"Row {i+1}: Skipped - insufficient columns ({len(row)} <= {tx_id_idx})")
-                    skipped_count += 1
-                    continue
+        records = []
+        seen_in_file = set()
+        
+        # Stream rows as plain tuples instead of materialising a list of lists
+        # Guard against autoflush scanning the session on any query that
+        # fires while records are pending
+        with db.session.no_autoflush:
+            for i, row in enumerate(data.itertuples(index=False, name=None)):
+                try:
+                    tx_id = safe_str(row[tx_id_idx]).strip()
+                    if not tx_id:
+                        logger.debug("Row %d: Skipped - empty transaction ID", i+1)
+                        skipped_count += 1
+                        continue
                 
-                tx_id = str(row[tx_id_idx] or '').strip()
-                if not tx_id:
-                    logger.warning(f"Row {i+1}: Skipped - empty transaction ID")
-                    skipped_count += 1
-                    continue
-                
-                logger.info(f"Row {i+1}: Processing transaction ID '{tx_id}'")
-                
-                # Check if already exists
-                existing = IBRebate.query.filter_by(transaction_id=tx_id).first()
-                if existing:
-                    logger.info(f"Row {i+1}: Skipped - transaction ID {tx_id} already exists in database")
-                    skipped_count += 1
-                    continue
+                    logger.debug("Row %d: Processing transaction ID '%s'", i+1, tx_id)
                 
-                rebate_value = float(row[rebate_idx] or 0) if rebate_idx is not None and rebate_idx < len(row) else 0
-                rebate_time = parse_date_flexible(row[rebate_time_idx]) if rebate_time_idx is not None and rebate_time_idx < len(row) else None
+                    # Check if already exists (in this file or in the database)
+                    if tx_id in seen_in_file or tx_id in existing_tx_ids:
+                        logger.debug("Row %d: Skipped - transaction ID %s already exists", i+1, tx_id)
+                        skipped_count += 1
+                        continue
                 
-                logger.info(f"Row {i+1}: rebate_value={rebate_value}, rebate_time={rebate_time}")
+                    rebate_value = rebate_vals[i]
+                    rebate_time = rebate_times[i]
                 
-                rebate = IBRebate(
-                    user_id=current_user.id,
-                    transaction_id=tx_id,
-                    rebate=rebate_value,
-                    rebate_time=rebate_time
-                )
+                    logger.debug("Row %d: rebate_value=%s, rebate_time=%s", i+1, rebate_value, rebate_time)
                 
-                db.session.add(rebate)
-                logger.info(f"Row {i+1}: Added rebate record for transaction {tx_id}")
-                added_count += 1
+                    records.append(dict(
+                        user_id=uid,
+                        transaction_id=tx_id,
+                        rebate=rebate_value,
+                        rebate_time=rebate_time
+                    ))
+                    seen_in_file.add(tx_id)
+                    logger.debug("Row %d: Added rebate record for transaction %s", i+1, tx_id)
+                    added_count += 1
                 
-            except Exception as e:
-                logger.error(f"Row {i+1}: Error processing - {e}")
-                skipped_count += 1
-                continue
-        
+                except Exception as e:
+                    logger.error(f"Row {i+1}: Error processing - {e}")
+                    skipped_count += 1
+                    continue
+
+        bulk_insert_records(IBRebate, records)
         db.session.commit()
-        logger.info(f"Processing complete: {added_count} added, {skipped_count} skipped")
-        return {'added_rows': added_count, 'total_rows': len(rows), 'skipped_rows': skipped_count}
-        
+        invalidate_report_cache(uid)
+        logger.info("Processing complete: %d added, %d skipped", added_count, skipped_count)
+        return {'added_rows': added_count, 'total_rows': total_rows, 'skipped_rows': skipped_count}
+
     except Exception as e:
         logger.error(f"Fatal error processing IB rebate data: {e}")
         db.session.rollback()
@@ -349,11 +609,11 @@ def process_crm_withdrawals(file_path, file_format='csv'):
             raise ValueError("File is empty or invalid")
         
         headers = data.columns.tolist()
-        rows = data.values.tolist()
-        
-        logger.info(f"File has {len(rows)} rows and {len(headers)} columns")
+        total_rows = len(data)
+
+        logger.info(f"File has {total_rows} rows and {len(headers)} columns")
         logger.info(f"Headers: {headers}")
-        
+
         # Find required columns
         req_time_idx = find_column_index(headers, ['Review Time', 'REVIEW_TIME'])
         trading_account_idx = find_column_index(headers, ['Trading Account', 'TRADING_ACCOUNT'])
@@ -369,64 +629,72 @@ def process_crm_withdrawals(file_path, file_format='csv'):
             if amount_idx is None: missing.append("Withdrawal Amount")
             if request_id_idx is None: missing.append("Request ID")
             raise ValueError(f"Required columns not found: {', '.join(missing)}")
-        
+
+        # Normalize the hot columns in vectorized passes instead of
+        # str().strip().upper() chains per row
+        request_id_vals = data.iloc[:, request_id_idx].astype(str).str.strip().tolist()
+        trading_accounts = data.iloc[:, trading_account_idx].astype(str).str.strip().tolist()
+
+        # Process withdrawal amounts (handle USC conversion) column-wise
+        amount_series = data.iloc[:, amount_idx].astype(str).str.strip().str.upper()
+        amounts = pd.to_numeric(amount_series.str.replace(_NON_NUMERIC_RE, '', regex=True), errors='coerce').fillna(0.0)
+        usc_mask = amount_series.str.contains('USC', regex=False)
+        amounts = amounts.where(~usc_mask, amounts / 100).tolist()
+
+        # Prefetch existing request IDs in one query instead of one per row
+        existing_request_ids = load_existing_keys(CRMWithdrawals.request_id, set(request_id_vals))
+
+        # Parse the Review Time column in one vectorized pass
+        review_times = parse_date_series(data.iloc[:, req_time_idx])
+
+        # Read the LocalProxy once; each access walks the request context
+        uid = current_user.id
         added_count = 0
         skipped_count = 0
-        
-        for i, row in enumerate(rows):
-            try:
-                max_idx = max(req_time_idx, trading_account_idx, amount_idx, request_id_idx)
-                if len(row) <= max_idx:
-                    logger.warning(f"Row {i+1}: Skipped - insufficient columns ({len(row)} <= {max_idx})")
-                    skipped_count += 1
-                    continue
-                
-                request_id = str(row[request_id_idx] or '').strip()
-                if not request_id:
-                    logger.warning(f"Row {i+1}: Skipped - empty request ID")
-                    skipped_count += 1
-                    continue
-                
-                logger.info(f"Row {i+1}: Processing request ID '{request_id}'")
+        records = []
+        seen_in_file = set()
+
+        # Guard against autoflush scanning the session on any query that
+        # fires while records are pending
+        with db.session.no_autoflush:
+            for i in range(total_rows):
+                try:
+                    request_id = request_id_vals[i]
+                    if not request_id:
+                        logger.debug("Row %d: Skipped - empty request ID", i+1)
+                        skipped_count += 1
+                        continue
+
+                    logger.debug("Row %d: Processing request ID '%s'", i+1, request_id)
+
+                    # Check if already exists (in this file or in the database)
+                    if request_id in seen_in_file or request_id in existing_request_ids:
+                        logger.debug("Row %d: Skipped - request ID %s already exists", i+1, request_id)
+                        skipped_count += 1
+                        continue
+
+                    records.append(dict(
+                        user_id=uid,
+                        request_id=request_id,
+                        review_time=review_times[i],
+                        trading_account=trading_accounts[i],
+                        withdrawal_amount=amounts[i]
+                    ))
+                    seen_in_file.add(request_id)
+                    logger.debug("Row %d: Added withdrawal record for request %s", i+1, request_id)
+                    added_count += 1
                 
-                # Check if already exists
-                existing = CRMWithdrawals.query.filter_by(request_id=request_id).first()
-                if existing:
-                    logger.info(f"Row {i+1}: Skipped - request ID {request_id} already exists in database")
+                except Exception as e:
+                    logger.error(f"Row {i+1}: Error processing - {e}")
                     skipped_count += 1
                     continue
-                
-                # Process withdrawal amount (handle USC conversion)
-                amount_val = str(row[amount_idx] or '').strip().upper()
-                if 'USD' in amount_val:
-                    amount = float(re.sub(r'[^0-9.-]', '', amount_val))
-                elif 'USC' in amount_val:
-                    raw_amount = float(re.sub(r'[^0-9.-]', '', amount_val))
-                    amount = raw_amount / 100 if not pd.isna(raw_amount) else 0
-                else:
-                    amount = float(re.sub(r'[^0-9.-]', '', amount_val)) if amount_val else 0
-                
-                withdrawal = CRMWithdrawals(
-                    user_id=current_user.id,
-                    request_id=request_id,
-                    review_time=parse_date_flexible(row[req_time_idx]),
-                    trading_account=str(row[trading_account_idx] or '').strip(),
-                    withdrawal_amount=amount
-                )
-                
-                db.session.add(withdrawal)
-                logger.info(f"Row {i+1}: Added withdrawal record for request {request_id}")
-                added_count += 1
-                
-            except Exception as e:
-                logger.error(f"Row {i+1}: Error processing - {e}")
-                skipped_count += 1
-                continue
-        
+
+        bulk_insert_records(CRMWithdrawals, records)
         db.session.commit()
-        logger.info(f"Processing complete: {added_count} added, {skipped_count} skipped")
-        return {'added_rows': added_count, 'total_rows': len(rows), 'skipped_rows': skipped_count}
-        
+        invalidate_report_cache(uid)
+        logger.info("Processing complete: %d added, %d skipped", added_count, skipped_count)
+        return {'added_rows': added_count, 'total_rows': total_rows, 'skipped_rows': skipped_count}
+
     except Exception as e:
         logger.error(f"Fatal error processing CRM withdrawals: {e}")
         db.session.rollback()
@@ -443,11 +711,11 @@ def process_crm_deposit(file_path, file_format='csv'):
             raise ValueError("File is empty or invalid")
         
         headers = data.columns.tolist()
-        rows = data.values.tolist()
-        
-        logger.info(f"File has {len(rows)} rows and {len(headers)} columns")
+        total_rows = len(data)
+
+        logger.info(f"File has {total_rows} rows and {len(headers)} columns")
         logger.info(f"Headers: {headers}")
-        
+
         # Find required columns
         req_idx = find_column_index(headers, ['Request Time', 'REQUEST_TIME'])
         acc_idx = find_column_index(headers, ['Trading Account', 'TRADING_ACCOUNT'])
@@ -466,71 +734,79 @@ def process_crm_deposit(file_path, file_format='csv'):
             if amt_idx is None: missing.append("Trading Amount")
             if id_idx is None: missing.append("Request ID")
             raise ValueError(f"Required columns not found: {', '.join(missing)}")
-        
+
+        # Normalize the hot columns in vectorized passes instead of
+        # str().strip() chains per row
+        n = total_rows
+        request_id_vals = data.iloc[:, id_idx].astype(str).str.strip().tolist()
+        trading_accounts = data.iloc[:, acc_idx].astype(str).str.strip().tolist()
+        payment_methods = data.iloc[:, pay_method_idx].astype(str).str.strip().tolist() if pay_method_idx is not None else [''] * n
+        client_ids = data.iloc[:, client_id_idx].astype(str).str.strip().tolist() if client_id_idx is not None else [''] * n
+        names = data.iloc[:, name_idx].astype(str).str.strip().tolist() if name_idx is not None else [''] * n
+
+        # Process trading amounts (handle USC conversion) column-wise
+        amount_series = data.iloc[:, amt_idx].astype(str).str.strip()
+        amounts = pd.to_numeric(amount_series.str.replace(_NON_NUMERIC_RE, '', regex=True), errors='coerce').fillna(0.0)
+        usc_mask = amount_series.str.contains('USC', regex=False)
+        amounts = amounts.where(~usc_mask, amounts / 100).tolist()
+
+        # Prefetch existing request IDs in one query instead of one per row
+        existing_request_ids = load_existing_keys(CRMDeposit.request_id, set(request_id_vals))
+
+        # Parse the Request Time column in one vectorized pass
+        request_times = parse_date_series(data.iloc[:, req_idx])
+
+        # Read the LocalProxy once; each access walks the request context
+        uid = current_user.id
         added_count = 0
         skipped_count = 0
-        
-        for i, row in enumerate(rows):
-            try:
-                required_indices = [idx for idx in [req_idx, acc_idx, amt_idx, id_idx] if idx is not None]
-                max_idx = max(required_indices)
-                
-                if len(row) <= max_idx:
-                    logger.warning(f"Row {i+1}: Skipped - insufficient columns ({len(row)} <= {max_idx})")
-                    skipped_count += 1
-                    continue
-                
-                request_id = str(row[id_idx] or '').strip()
-                if not request_id:
-                    logger.warning(f"Row {i+1}: Skipped - empty request ID")
-                    skipped_count += 1
-                    continue
-                
-                logger.info(f"Row {i+1}: Processing request ID '{request_id}'")
+        records = []
+        seen_in_file = set()
+
+        # Guard against autoflush scanning the session on any query that
+        # fires while records are pending
+        with db.session.no_autoflush:
+            for i in range(n):
+                try:
+                    request_id = request_id_vals[i]
+                    if not request_id:
+                        logger.debug("Row %d: Skipped - empty request ID", i+1)
+                        skipped_count += 1
+                        continue
+
+                    logger.debug("Row %d: Processing request ID '%s'", i+1, request_id)
+
+                    # Check if already exists (in this file or in the database)
+                    if request_id in seen_in_file or request_id in existing_request_ids:
+                        logger.debug("Row %d: Skipped - request ID %s already exists", i+1, request_id)
+                        skipped_count += 1
+                        continue
+
+                    records.append(dict(
+                        user_id=uid,
+                        request_id=request_id,
+                        request_time=request_times[i],
+                        trading_account=trading_accounts[i],
+                        trading_amount=amounts[i],
+                        payment_method=payment_methods[i],
+                        client_id=client_ids[i],
+                        name=names[i]
+                    ))
+                    seen_in_file.add(request_id)
+                    logger.debug("Row %d: Added deposit record for request %s", i+1, request_id)
+                    added_count += 1
                 
-                # Check if already exists
-                existing = CRMDeposit.query.filter_by(request_id=request_id).first()
-                if existing:
-                    logger.info(f"Row {i+1}: Skipped - request ID {request_id} already exists in database")
+                except Exception as e:
+                    logger.error(f"Row {i+1}: Error processing - {e}")
                     skipped_count += 1
                     continue
-                
-                # Process trading amount (handle USC conversion)
-                amount_val = str(row[amt_idx] or '').strip()
-                if 'USC' in amount_val:
-                    parts = amount_val.split()
-                    if len(parts) > 1:
-                        number_part = re.sub(r'[^0-9.-]', '', parts[1])
-                        amount = float(number_part) / 100 if number_part else 0
-                    else:
-                        amount = 0
-                else:
-                    amount = float(re.sub(r'[^0-9.-]', '', amount_val)) if amount_val else 0
-                
-                deposit = CRMDeposit(
-                    user_id=current_user.id,
-                    request_id=request_id,
-                    request_time=parse_date_flexible(row[req_idx]),
-                    trading_account=str(row[acc_idx] or '').strip(),
-                    trading_amount=amount,
-                    payment_method=str(row[pay_method_idx] or '').strip() if pay_method_idx is not None and pay_method_idx < len(row) else '',
-                    client_id=str(row[client_id_idx] or '').strip() if client_id_idx is not None and client_id_idx < len(row) else '',
-                    name=str(row[name_idx] or '').strip() if name_idx is not None and name_idx < len(row) else ''
-                )
-                
-                db.session.add(deposit)
-                logger.info(f"Row {i+1}: Added deposit record for request {request_id}")
-                added_count += 1
-                
-            except Exception as e:
-                logger.error(f"Row {i+1}: Error processing - {e}")
-                skipped_count += 1
-                continue
-        
+
+        bulk_insert_records(CRMDeposit, records)
         db.session.commit()
-        logger.info(f"Processing complete: {added_count} added, {skipped_count} skipped")
-        return {'added_rows': added_count, 'total_rows': len(rows), 'skipped_rows': skipped_count}
-        
+        invalidate_report_cache(uid)
+        logger.info("Processing complete: %d added, %d skipped", added_count, skipped_count)
+        return {'added_rows': added_count, 'total_rows': total_rows, 'skipped_rows': skipped_count}
+
     except Exception as e:
         logger.error(f"Fatal error processing CRM deposits: {e}")
         db.session.rollback()
@@ -546,17 +822,18 @@ def process_account_list(file_path, file_format='csv'):
         if data.empty:
             raise ValueError("File is empty or invalid")
         
-        # Remove description line if present
+        # CSV reads already drop the description line at parse time; this
+        # only still fires for XLSX files
         if len(data) > 0 and 'METATRADER' in str(data.iloc[0, 0]).upper():
             data = data.iloc[1:]
             logger.info("Removed MetaTrader description line")
         
         headers = data.columns.tolist()
-        rows = data.values.tolist()
-        
-        logger.info(f"File has {len(rows)} rows and {len(headers)} columns")
+        total_rows = len(data)
+
+        logger.info(f"File has {total_rows} rows and {len(headers)} columns")
         logger.info(f"Headers: {headers}")
-        
+
         # Find required columns
         login_idx = find_column_index(headers, ['Login'], 'Login')
         name_idx = find_column_index(headers, ['Name'], 'Name')
@@ -571,55 +848,72 @@ def process_account_list(file_path, file_format='csv'):
             if group_idx is None: missing.append("Group")
             raise ValueError(f"Required columns not found: {', '.join(missing)}")
         
+        # Read the LocalProxy once; each access walks the request context
+        uid = current_user.id
+
         # Clear existing account list for this user
-        deleted_count = AccountList.query.filter_by(user_id=current_user.id).delete()
+        deleted_count = AccountList.query.filter_by(user_id=uid).delete()
         logger.info(f"Deleted {deleted_count} existing account records for user")
-        
+
         added_count = 0
         skipped_count = 0
-        
-        for i, row in enumerate(rows):
-            try:
-                max_idx = max(login_idx, name_idx, group_idx)
-                if len(row) <= max_idx:
-                    logger.warning(f"Row {i+1}: Skipped - insufficient columns ({len(row)} <= {max_idx})")
-                    skipped_count += 1
-                    continue
+        records = []
+        seen_in_file = set()
+        
+        # Stream rows as plain tuples instead of materialising a list of lists
+        # Guard against autoflush scanning the session on any query that
+        # fires while records are pending
+        with db.session.no_autoflush:
+            for i, row in enumerate(data.itertuples(index=False, name=None)):
+                try:
+                    login = safe_str(row[login_idx]).strip()
+                    name = safe_str(row[name_idx]).strip()
+                    group = safe_str(row[group_idx]).strip()
                 
-                login = str(row[login_idx] or '').strip()
-                name = str(row[name_idx] or '').strip()
-                group = str(row[group_idx] or '').strip()
+                    if not login:
+                        logger.debug("Row %d: Skipped - empty login", i+1)
+                        skipped_count += 1
+                        continue
+
+                    if login in seen_in_file:
+                        logger.debug("Row %d: Skipped - duplicate login %s in file", i+1, login)
+                        skipped_count += 1
+                        continue
+                    seen_in_file.add(login)
+
+                    logger.debug("Row %d: Processing login '%s'", i+1, login)
                 
-                if not login:
-                    logger.warning(f"Row {i+1}: Skipped - empty login")
+                    is_welcome = group == "WELCOME\\Welcome BBOOK"
+                
+                    records.append(dict(
+                        user_id=uid,
+                        login=login,
+                        name=name,
+                        group=group,
+                        is_welcome_bonus=is_welcome
+                    ))
+                    logger.debug("Row %d: Added account record for login %s", i+1, login)
+                    added_count += 1
+
+                except Exception as e:
+                    logger.error(f"Row {i+1}: Error processing - {e}")
                     skipped_count += 1
                     continue
-                
-                logger.info(f"Row {i+1}: Processing login '{login}'")
-                
-                is_welcome = group == "WELCOME\\Welcome BBOOK"
-                
-                account = AccountList(
-                    user_id=current_user.id,
-                    login=login,
-                    name=name,
-                    group=group,
-                    is_welcome_bonus=is_welcome
-                )
-                
-                db.session.add(account)
-                logger.info(f"Row {i+1}: Added account record for login {login}")
-                added_count += 1
-                
-            except Exception as e:
-                logger.error(f"Row {i+1}: Error processing - {e}")
-                skipped_count += 1
-                continue
-        
+
+        inserted_count = bulk_insert_records(AccountList, records)
+        if inserted_count < added_count:
+            # login is unique across users, so rows clashing with another
+            # user's accounts are dropped by the conflict clause; report
+            # them as skipped rather than added
+            logger.warning("%d rows conflicted with existing logins and were not inserted",
+                           added_count - inserted_count)
+            skipped_count += added_count - inserted_count
+            added_count = inserted_count
         db.session.commit()
-        logger.info(f"Processing complete: {added_count} added, {skipped_count} skipped")
-        return {'added_rows': added_count, 'total_rows': len(rows), 'skipped_rows': skipped_count}
-        
+        invalidate_report_cache(uid)
+        logger.info("Processing complete: %d added, %d skipped", added_count, skipped_count)
+        return {'added_rows': added_count, 'total_rows': total_rows, 'skipped_rows': skipped_count}
+
     except Exception as e:
         logger.error(f"Fatal error processing account list: {e}")
         db.session.rollback()
@@ -632,91 +926,97 @@ def check_existing_records(file_path, file_type, file_format='csv'):
     This is useful for debugging why files show 0 added rows
     """
     logger.info(f"Checking existing records for {file_type} in {file_path}")
-    
+
     try:
-        data = read_file_with_encoding(file_path, file_format)
-        
-        if data.empty:
-            return {"error": "File is empty"}
-        
-        headers = data.columns.tolist()
-        rows = data.values.tolist()
-        
+        # For CSVs only the key column is needed, so read just the
+        # header row here and stream that one column below instead of
+        # loading the whole file
+        separator = None
+        if file_format.lower() == 'csv':
+            encoding, sample = detect_encoding_and_sample(file_path)
+            if not sample:
+                return {"error": "File is empty"}
+            separator = detect_separator(sample.decode(encoding, errors='replace')[:8192])
+            data = None
+            headers = pd.read_csv(file_path, sep=separator, encoding=encoding,
+                                  nrows=0, dtype=str).columns.tolist()
+        else:
+            data = read_file_with_encoding(file_path, file_format)
+            if data.empty:
+                return {"error": "File is empty"}
+            headers = data.columns.tolist()
+
         existing_count = 0
         new_count = 0
-        
+
+        # Resolve the key column for the file type, collect its values
+        # once, then check them against the database with a single
+        # chunked IN query instead of one SELECT per row
+        key_column = None
+        key_idx = None
+
         if file_type.lower() == 'ib_rebate':
-            tx_id_idx = find_column_index(headers, ['Transaction ID'], 'Transaction ID')
-            if tx_id_idx is None:
+            key_idx = find_column_index(headers, ['Transaction ID'], 'Transaction ID')
+            if key_idx is None:
                 return {"error": "Transaction ID column not found"}
-            
-            for row in rows:
-                if len(row) > tx_id_idx:
-                    tx_id = str(row[tx_id_idx] or '').strip()
-                    if tx_id:
-                        existing = IBRebate.query.filter_by(transaction_id=tx_id).first()
-                        if existing:
-                            existing_count += 1
-                        else:
-                            new_count += 1
-        
+            key_column = IBRebate.transaction_id
+
         elif file_type.lower() == 'payment_data':
-            # Find transaction ID column for payment data
-            tx_id_col = None
-            for header in headers:
-                if 'Transaction ID' in header:
-                    tx_id_col = header
-                    break
-            
-            if tx_id_col is None:
+            key_idx = find_column_index(headers, ['Transaction ID'])
+            if key_idx is None:
                 return {"error": "Transaction ID column not found"}
-            
-            for i, row in enumerate(rows):
-                row_dict = {}
-                for j, header in enumerate(headers):
-                    if j < len(row):
-                        row_dict[header.strip()] = row[j]
-                
-                tx_id = str(row_dict.get(tx_id_col, '')).strip()
-                if tx_id:
-                    existing = PaymentData.query.filter_by(tx_id=tx_id).first()
-                    if existing:
-                        existing_count += 1
-                    else:
-                        new_count += 1
-        
+            key_column = PaymentData.tx_id
+
         elif file_type.lower() == 'crm_withdrawals':
-            request_id_idx = find_column_index(headers, ['Request ID'], 'Request ID')
-            if request_id_idx is None:
+            key_idx = find_column_index(headers, ['Request ID'], 'Request ID')
+            if key_idx is None:
                 return {"error": "Request ID column not found"}
-            
-            for row in rows:
-                if len(row) > request_id_idx:
-                    request_id = str(row[request_id_idx] or '').strip()
-                    if request_id:
-                        existing = CRMWithdrawals.query.filter_by(request_id=request_id).first()
-                        if existing:
-                            existing_count += 1
-                        else:
-                            new_count += 1
-        
+            key_column = CRMWithdrawals.request_id
+
         elif file_type.lower() == 'crm_deposit':
-            request_id_idx = find_column_index(headers, ['Request ID'], 'Request ID')
-            if request_id_idx is None:
+            key_idx = find_column_index(headers, ['Request ID'], 'Request ID')
+            if key_idx is None:
                 return {"error": "Request ID column not found"}
-            
-            for row in rows:
-                if len(row) > request_id_idx:
-                    request_id = str(row[request_id_idx] or '').strip()
-                    if request_id:
-                        existing = CRMDeposit.query.filter_by(request_id=request_id).first()
-                        if existing:
-                            existing_count += 1
-                        else:
-                            new_count += 1
-        
+            key_column = CRMDeposit.request_id
+
+        ids = set()
+        total_rows = 0
+
+        if key_column is not None and data is None:
+            # Stream just the key column in bounded chunks; peak memory
+            # stays O(chunk) no matter how large the upload is
+            col_name = headers[key_idx]
+            for chunk in pd.read_csv(file_path, sep=separator, encoding=encoding,
+                                     usecols=[col_name], engine='c', dtype=str,
+                                     na_filter=False, chunksize=100000):
+                total_rows += len(chunk)
+                col = chunk[col_name].str.strip()
+                ids.update(col[col.str.len() > 0].unique())
+            if total_rows == 0:
+                return {"error": "File is empty"}
+        elif data is None:
+            # Unknown file type: still report the row count without
+            # parsing every column
+            for chunk in pd.read_csv(file_path, sep=separator, encoding=encoding,
+                                     usecols=[0], engine='c', dtype=str,
+                                     na_filter=False, chunksize=100000):
+                total_rows += len(chunk)
+            if total_rows == 0:
+                return {"error": "File is empty"}
+        else:
+            total_rows = len(data)
+            if key_column is not None:
+                # One vectorized pass over the key column instead of a
+                # Python cast per cell across the whole row list
+                col = data.iloc[:, key_idx].astype(str).str.strip()
+                ids = set(col[col.str.len() > 0].unique())
+
+        if key_column is not None:
+            existing_count = len(load_existing_keys(key_column, ids))
+            new_count = len(ids) - existing_count
+
         return {
-            "total_rows": len(rows),
+            "total_rows": total_rows,
             "existing_in_db": existing_count,
             "new_records": new_count,
             "headers": headers
@@ -767,18 +1067,18 @@ def debug_file_processing(file_path, file_type, file_format='csv'):
             logger.info(f"  - Rebate Time: {'✓' if rebate_time_idx is not None else '✗'} (index: {rebate_time_idx})")
             
             if tx_id_idx is not None:
-                rows = data.values.tolist()
+                # Check first 5 rows against the database in one query
+                sample_ids = [safe_str(v).strip() for v in data.iloc[:5, tx_id_idx].tolist()]
+                existing_ids = load_existing_keys(IBRebate.transaction_id, set(sample_ids))
                 valid_rows = 0
-                for i, row in enumerate(rows[:5]):  # Check first 5 rows
-                    tx_id = str(row[tx_id_idx] or '').strip() if len(row) > tx_id_idx else ''
+                for i, tx_id in enumerate(sample_ids):
                     if tx_id:
                         valid_rows += 1
-                        existing = IBRebate.query.filter_by(transaction_id=tx_id).first()
-                        logger.info(f"  Row {i+1}: tx_id='{tx_id}', exists_in_db={existing is not None}")
+                        logger.info(f"  Row {i+1}: tx_id='{tx_id}', exists_in_db={tx_id in existing_ids}")
                     else:
                         logger.info(f"  Row {i+1}: Empty transaction ID")
-                
-                logger.info(f"Valid rows with transaction IDs: {valid_rows}/{min(5, len(rows))}")
+
+                logger.info(f"Valid rows with transaction IDs: {valid_rows}/{len(sample_ids)}")
         
         # Step 5: Check existing records
         logger.info("Step 5: Checking existing records...")
@@ -823,19 +1123,20 @@ def clear_user_data(data_type, user_id=None):
     logger.warning(f"CLEARING {data_type} data for user {user_id}")
     
     if data_type.lower() == 'ib_rebate':
-        deleted = IBRebate.query.filter_by(user_id=user_id).delete()
+        deleted = IBRebate.query.filter_by(user_id=user_id).delete(synchronize_session=False)
     elif data_type.lower() == 'payment_data':
-        deleted = PaymentData.query.filter_by(user_id=user_id).delete()
+        deleted = PaymentData.query.filter_by(user_id=user_id).delete(synchronize_session=False)
     elif data_type.lower() == 'crm_withdrawals':
-        deleted = CRMWithdrawals.query.filter_by(user_id=user_id).delete()
+        deleted = CRMWithdrawals.query.filter_by(user_id=user_id).delete(synchronize_session=False)
     elif data_type.lower() == 'crm_deposit':
-        deleted = CRMDeposit.query.filter_by(user_id=user_id).delete()
+        deleted = CRMDeposit.query.filter_by(user_id=user_id).delete(synchronize_session=False)
     elif data_type.lower() == 'account_list':
-        deleted = AccountList.query.filter_by(user_id=user_id).delete()
+        deleted = AccountList.query.filter_by(user_id=user_id).delete(synchronize_session=False)
     else:
         logger.error(f"Unknown data type: {data_type}")
         return 0
     
     db.session.commit()
+    invalidate_report_cache(user_id)
     logger.warning(f"Deleted {deleted} records")
     return deleted
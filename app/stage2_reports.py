@@ -1,9 +1,20 @@
+import math
 import pandas as pd
+import re
+from collections import defaultdict
 from datetime import datetime
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, case, func
+from app import db
 from app.models import PaymentData, IBRebate, CRMWithdrawals, CRMDeposit, AccountList
 from flask_login import current_user
 
+# Login extraction pattern, compiled once at import time
+_LOGIN_RE = re.compile(r'\d+')
+
+# Time bucket width for the deposit matcher; wide enough that the 3.5h
+# tolerance only ever spans adjacent buckets
+_BUCKET_SECONDS = 4 * 3600
+
 def filter_by_date_range(query, start_date, end_date, date_column):
     """Apply date range filter to query"""
     if start_date and end_date:
@@ -24,82 +35,83 @@ def sum_column_from_query(query, column_name):
 
 def generate_final_report(start_date=None, end_date=None):
     """Generate comprehensive final report"""
-    
-    # Base queries for current user
-    payment_query = PaymentData.query.filter_by(user_id=current_user.id)
-    rebate_query = IBRebate.query.filter_by(user_id=current_user.id)
+
+    # Aggregate queries for current user; conditional SUM(CASE ...)
+    # aggregates compute every metric over a table in one scan instead
+    # of loading the rows and summing them in Python
+    rebate_query = db.session.query(
+        func.coalesce(func.sum(IBRebate.rebate), 0.0)
+    ).filter(IBRebate.user_id == current_user.id)
+
+    payment_query = db.session.query(
+        func.coalesce(func.sum(case((PaymentData.sheet_category == 'M2p Deposit', PaymentData.final_amount), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((PaymentData.sheet_category == 'Settlement Deposit', PaymentData.final_amount), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((PaymentData.sheet_category == 'M2p Withdraw', PaymentData.final_amount), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((PaymentData.sheet_category == 'Settlement Withdraw', PaymentData.final_amount), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((PaymentData.sheet_category.in_(('M2p Deposit', 'Settlement Deposit')), PaymentData.tier_fee), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((PaymentData.sheet_category.in_(('M2p Withdraw', 'Settlement Withdraw')), PaymentData.tier_fee), else_=0.0)), 0.0)
+    ).filter(PaymentData.user_id == current_user.id)
+
+    crm_deposit_query = db.session.query(
+        func.coalesce(func.sum(CRMDeposit.trading_amount), 0.0),
+        func.coalesce(func.sum(case((func.upper(CRMDeposit.payment_method) == 'TOPCHANGE', CRMDeposit.trading_amount), else_=0.0)), 0.0)
+    ).filter(CRMDeposit.user_id == current_user.id)
+
     crm_withdraw_query = CRMWithdrawals.query.filter_by(user_id=current_user.id)
-    crm_deposit_query = CRMDeposit.query.filter_by(user_id=current_user.id)
-    
+
     # Apply date filters if provided
     if start_date and end_date:
         payment_query = filter_by_date_range(payment_query, start_date, end_date, PaymentData.created)
         rebate_query = filter_by_date_range(rebate_query, start_date, end_date, IBRebate.rebate_time)
         crm_withdraw_query = filter_by_date_range(crm_withdraw_query, start_date, end_date, CRMWithdrawals.review_time)
         crm_deposit_query = filter_by_date_range(crm_deposit_query, start_date, end_date, CRMDeposit.request_time)
-    
+
     # Calculate totals
     calculations = {}
-    
+
     # 1. Total Rebate
-    calculations['Total Rebate'] = sum_column_from_query(rebate_query.all(), 'rebate')
-    
-    # 2. Deposits by category
-    m2p_deposits = payment_query.filter_by(sheet_category='M2p Deposit').all()
-    settlement_deposits = payment_query.filter_by(sheet_category='Settlement Deposit').all()
-    
-    calculations['M2p Deposit'] = sum_column_from_query(m2p_deposits, 'final_amount')
-    calculations['Settlement Deposit'] = sum_column_from_query(settlement_deposits, 'final_amount')
-    
-    # 3. Withdrawals by category
-    m2p_withdraws = payment_query.filter_by(sheet_category='M2p Withdraw').all()
-    settlement_withdraws = payment_query.filter_by(sheet_category='Settlement Withdraw').all()
-    
-    calculations['M2p Withdrawal'] = sum_column_from_query(m2p_withdraws, 'final_amount')
-    calculations['Settlement Withdrawal'] = sum_column_from_query(settlement_withdraws, 'final_amount')
-    
-    # 4. CRM Deposit Total
-    calculations['CRM Deposit Total'] = sum_column_from_query(crm_deposit_query.all(), 'trading_amount')
-    
+    calculations['Total Rebate'] = float(rebate_query.scalar())
+
+    # 2-3. Deposits, withdrawals and tier fees by category
+    m2p_dep, set_dep, m2p_wd, set_wd, tier_fee_deposit, tier_fee_withdraw = payment_query.one()
+
+    calculations['M2p Deposit'] = float(m2p_dep)
+    calculations['Settlement Deposit'] = float(set_dep)
+    calculations['M2p Withdrawal'] = float(m2p_wd)
+    calculations['Settlement Withdrawal'] = float(set_wd)
+
+    # 4. CRM Deposit Total (with the TopChange subtotal from the same scan)
+    crm_deposit_total, topchange_total = crm_deposit_query.one()
+    calculations['CRM Deposit Total'] = float(crm_deposit_total)
+
     # 5. Tier Fees
-    tier_fee_deposit = (sum_column_from_query(m2p_deposits, 'tier_fee') + 
-                       sum_column_from_query(settlement_deposits, 'tier_fee'))
-    tier_fee_withdraw = (sum_column_from_query(m2p_withdraws, 'tier_fee') + 
-                        sum_column_from_query(settlement_withdraws, 'tier_fee'))
-    
-    calculations['Tier Fee Deposit'] = tier_fee_deposit
-    calculations['Tier Fee Withdraw'] = tier_fee_withdraw
-    
+    calculations['Tier Fee Deposit'] = float(tier_fee_deposit)
+    calculations['Tier Fee Withdraw'] = float(tier_fee_withdraw)
+
     # 6. Welcome Bonus Withdrawals
-    welcome_accounts = AccountList.query.filter_by(user_id=current_user.id, is_welcome_bonus=True).all()
-    welcome_logins = [acc.login for acc in welcome_accounts]
-    
+    welcome_logins = {login for (login,) in AccountList.query.with_entities(
+        AccountList.login
+    ).filter_by(user_id=current_user.id, is_welcome_bonus=True)}
+
+    # The login extraction has to stay in Python (SQLite has no regexp
+    # function), but membership is now a set lookup instead of a list scan
     welcome_withdraw_sum = 0
     if welcome_logins:
-        for withdrawal in crm_withdraw_query.all():
-            # Extract login number from trading account
-            trading_account = str(withdrawal.trading_account or '')
-            login_match = None
-            import re
-            match = re.search(r'\d+', trading_account)
-            if match:
-                login_match = match.group()
-            
-            if login_match and login_match in welcome_logins:
-                welcome_withdraw_sum += float(withdrawal.withdrawal_amount or 0)
-    
+        for trading_account, withdrawal_amount in crm_withdraw_query.with_entities(
+                CRMWithdrawals.trading_account, CRMWithdrawals.withdrawal_amount):
+            match = _LOGIN_RE.search(trading_account) if trading_account else None
+            if match and match.group() in welcome_logins:
+                welcome_withdraw_sum += float(withdrawal_amount or 0)
+
     calculations['Welcome Bonus Withdrawals'] = welcome_withdraw_sum
-    
+
     # 7. CRM TopChange Total
-    topchange_total = 0
-    for deposit in crm_deposit_query.all():
-        if (deposit.payment_method or '').upper() == 'TOPCHANGE':
-            topchange_total += float(deposit.trading_amount or 0)
-    
-    calculations['CRM TopChange Total'] = topchange_total
-    
+    calculations['CRM TopChange Total'] = float(topchange_total)
+
     # 8. CRM Withdraw Total
-    calculations['CRM Withdraw Total'] = sum_column_from_query(crm_withdraw_query.all(), 'withdrawal_amount')
+    calculations['CRM Withdraw Total'] = float(crm_withdraw_query.with_entities(
+        func.coalesce(func.sum(CRMWithdrawals.withdrawal_amount), 0.0)
+    ).scalar())
     
     # Format as list of tuples for display
     report_data = []
@@ -130,66 +142,96 @@ def compare_crm_and_client_deposits(start_date=None, end_date=None):
         crm_query = filter_by_date_range(crm_query, start_date, end_date, CRMDeposit.request_time)
         client_query = filter_by_date_range(client_query, start_date, end_date, PaymentData.created)
     
-    crm_deposits = crm_query.all()
-    client_deposits = client_query.all()
-    
-    # Normalize data for comparison
-    crm_normalized = []
-    for deposit in crm_deposits:
-        crm_normalized.append({
-            'date': deposit.request_time,
-            'client_id': (deposit.client_id or '').strip().lower(),
-            'name': deposit.name or '',
-            'amount': float(deposit.trading_amount or 0),
-            'payment_method': (deposit.payment_method or '').strip().lower(),
-            'source': 'CRM Deposit',
-            'id': deposit.id
-        })
-    
+    # Fetch only the compared columns and normalize them in vectorized
+    # passes instead of building one dict at a time from full ORM rows.
+    # A merge_asof nearest-join cannot express the exclusive first-match
+    # semantics below, so the bucketed matcher keeps doing the join.
+    # The CRM side is only walked once as the probe stream, so it is not
+    # materialized up front; only the client side needs a full index.
+    crm_rows = crm_query.with_entities(
+        CRMDeposit.request_time, CRMDeposit.client_id, CRMDeposit.name,
+        CRMDeposit.trading_amount, CRMDeposit.payment_method, CRMDeposit.id
+    ).yield_per(5000)
+
+    client_df = pd.DataFrame(client_query.with_entities(
+        PaymentData.created, PaymentData.trading_account,
+        PaymentData.final_amount, PaymentData.id
+    ).all(), columns=['date', 'account', 'amount', 'id'])
+
     client_normalized = []
-    for deposit in client_deposits:
-        client_normalized.append({
-            'date': deposit.created,
-            'account': (deposit.trading_account or '').strip().lower(),
-            'amount': float(deposit.final_amount or 0),
-            'source': 'M2p Deposit',
-            'id': deposit.id
-        })
-    
+    if not client_df.empty:
+        client_df['account'] = client_df['account'].fillna('').str.strip().str.lower()
+        client_df['amount'] = client_df['amount'].fillna(0.0).astype(float)
+        client_df['source'] = 'M2p Deposit'
+        # Plain datetimes, not Timestamps: naive Timestamp.timestamp()
+        # assumes UTC while datetime.timestamp() assumes local time, so
+        # mixing the two shifts the bucket keys by the UTC offset
+        dates = pd.to_datetime(client_df['date'], errors='coerce')
+        client_df['date'] = pd.Series(dates.dt.to_pydatetime(), index=client_df.index,
+                                      dtype=object).where(dates.notna(), None)
+        client_normalized = client_df.to_dict('records')
+    
+    # Bucket client deposits by (time window, whole-dollar amount) so
+    # each CRM row probes a handful of candidates instead of rescanning
+    # the whole client list; the nested loop was O(N x M)
+    buckets = defaultdict(list)
+    for idx, client_row in enumerate(client_normalized):
+        # Character set of the account doubles as a cheap prefilter: a
+        # client_id can only be a substring if all its characters occur
+        # in the account, so most candidate pairs skip the substring scan
+        client_row['chars'] = frozenset(client_row['account'])
+        if client_row['date']:
+            time_bucket = int(client_row['date'].timestamp()) // _BUCKET_SECONDS
+            amount_bucket = math.floor(client_row['amount'])
+            buckets[(time_bucket, amount_bucket)].append((idx, client_row))
+
     # Find matches and discrepancies
     matched = set()
     unmatched = []
-    
-    # Compare CRM with Client deposits
-    for crm_row in crm_normalized:
+
+    # Compare CRM with Client deposits; the 3.5h/±$1 tolerances span at
+    # most the neighbouring bucket on either axis
+    for crm_date, crm_client_id, crm_name, crm_amount, crm_method, crm_id in crm_rows:
+        crm_client_id = (crm_client_id or '').strip().lower()
+        crm_chars = frozenset(crm_client_id)
+        crm_amount = float(crm_amount or 0.0)
+
         match_found = False
-        for client_row in client_normalized:
-            if client_row['id'] in matched:
-                continue
-            
-            # Check if dates are within 3.5 hours of each other
-            if crm_row['date'] and client_row['date']:
-                time_diff = abs((crm_row['date'] - client_row['date']).total_seconds())
+        if crm_date:
+            time_bucket = int(crm_date.timestamp()) // _BUCKET_SECONDS
+            amount_bucket = math.floor(crm_amount)
+            candidates = []
+            for tb in (time_bucket - 1, time_bucket, time_bucket + 1):
+                for ab in (amount_bucket - 1, amount_bucket, amount_bucket + 1):
+                    candidates.extend(buckets.get((tb, ab), ()))
+
+            # Probe candidates in original client order, as the old scan did
+            for idx, client_row in sorted(candidates, key=lambda c: c[0]):
+                if client_row['id'] in matched:
+                    continue
+
+                # Check if dates are within 3.5 hours of each other
+                time_diff = abs((crm_date - client_row['date']).total_seconds())
                 if time_diff <= 3.5 * 3600:  # 3.5 hours
                     # Check if client ID is in trading account
-                    if crm_row['client_id'] in client_row['account']:
+                    if crm_chars <= client_row['chars'] and crm_client_id in client_row['account']:
                         # Check if amounts are similar (within $1)
-                        if abs(crm_row['amount'] - client_row['amount']) <= 1:
+                        if abs(crm_amount - client_row['amount']) <= 1:
                             matched.add(client_row['id'])
                             match_found = True
                             break
-        
+
         # If no match found and not TopChange, add to unmatched
-        if not match_found and crm_row['payment_method'] != 'topchange':
+        if not match_found and (crm_method or '').strip().lower() != 'topchange':
             unmatched.append([
-                crm_row['source'],
-                crm_row['date'].strftime('%Y-%m-%d') if crm_row['date'] else '',
-                crm_row['client_id'],
+                'CRM Deposit',
+                crm_date.strftime('%Y-%m-%d') if crm_date else '',
+                crm_client_id,
                 '',
-                f"{crm_row['amount']:.2f}",
-                crm_row['name'],
+                f"{crm_amount:.2f}",
+                crm_name or '',
                 'N',  # Confirmed status
-                crm_row['id']
+                crm_id
             ])
     
     # Add unmatched client deposits
@@ -214,13 +256,20 @@ def compare_crm_and_client_deposits(start_date=None, end_date=None):
         'total_discrepancies': len(unmatched)
     }
 
-def get_payment_data_by_category(category, start_date=None, end_date=None):
-    """Get payment data filtered by category and optionally by date range"""
+def get_payment_data_by_category(category, start_date=None, end_date=None, columns=None):
+    """Get payment data filtered by category and optionally by date range
+
+    When columns is given (a sequence of PaymentData columns), returns a
+    streaming iterator of plain row tuples instead of hydrated ORM
+    objects, which keeps exports of large categories out of memory.
+    """
     query = PaymentData.query.filter_by(user_id=current_user.id, sheet_category=category)
     
     if start_date and end_date:
         query = filter_by_date_range(query, start_date, end_date, PaymentData.created)
     
+    if columns is not None:
+        return query.with_entities(*columns).yield_per(5000)
     return query.all()
 
 def get_summary_data_for_charts(start_date=None, end_date=None):
@@ -1,10 +1,35 @@
+import functools
+import math
 import pandas as pd
+import re
+import time
+from collections import defaultdict
 from datetime import datetime
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, case, func
+from app import db
 from app.models import PaymentData, IBRebate, CRMWithdrawals, CRMDeposit, AccountList
 from flask_login import current_user
 import traceback
 
+# Login extraction pattern, compiled once at import time
+_LOGIN_RE = re.compile(r'\d+')
+
+# Time bucket width for the deposit matcher; wide enough that the 3.5h
+# tolerance only ever spans adjacent buckets
+_BUCKET_SECONDS = 4 * 3600
+
+# Dashboards re-render the same date range repeatedly while the
+# underlying tables only change on upload, so metric results are cached
+# per (user, range) for a short window; ingests invalidate explicitly
+_METRICS_CACHE = {}
+_METRICS_CACHE_TTL = 60  # seconds
+_METRICS_CACHE_MAX = 256
+
+def invalidate_report_cache(user_id):
+    """Drop cached report metrics for a user after data changes"""
+    for key in [k for k in _METRICS_CACHE if k[0] == user_id]:
+        _METRICS_CACHE.pop(key, None)
+
 def filter_by_date_range(query, start_date, end_date, date_column):
     """Apply date range filter to query"""
     if start_date and end_date:
@@ -28,25 +53,21 @@ def check_data_sufficiency_for_charts(start_date=None, end_date=None):
     Check if there's sufficient data for meaningful chart generation
     Returns True if charts should be shown, False if table should be shown instead
     """
-    # Base queries for current user
-    payment_query = PaymentData.query.filter_by(user_id=current_user.id)
-    rebate_query = IBRebate.query.filter_by(user_id=current_user.id)
-    crm_withdraw_query = CRMWithdrawals.query.filter_by(user_id=current_user.id)
-    crm_deposit_query = CRMDeposit.query.filter_by(user_id=current_user.id)
-    
-    # Apply date filters if provided
-    if start_date and end_date:
-        payment_query = filter_by_date_range(payment_query, start_date, end_date, PaymentData.created)
-        rebate_query = filter_by_date_range(rebate_query, start_date, end_date, IBRebate.rebate_time)
-        crm_withdraw_query = filter_by_date_range(crm_withdraw_query, start_date, end_date, CRMWithdrawals.review_time)
-        crm_deposit_query = filter_by_date_range(crm_deposit_query, start_date, end_date, CRMDeposit.request_time)
-    
-    # Count total records
-    payment_count = payment_query.count()
-    rebate_count = rebate_query.count()
-    crm_withdraw_count = crm_withdraw_query.count()
-    crm_deposit_count = crm_deposit_query.count()
-    
+    # Count all four tables in one round trip instead of four separate
+    # .count() queries
+    def count_subquery(model, date_column):
+        query = db.session.query(func.count()).select_from(model).filter(model.user_id == current_user.id)
+        if start_date and end_date:
+            query = filter_by_date_range(query, start_date, end_date, date_column)
+        return query.scalar_subquery()
+
+    payment_count, rebate_count, crm_withdraw_count, crm_deposit_count = db.session.query(
+        count_subquery(PaymentData, PaymentData.created),
+        count_subquery(IBRebate, IBRebate.rebate_time),
+        count_subquery(CRMWithdrawals, CRMWithdrawals.review_time),
+        count_subquery(CRMDeposit, CRMDeposit.request_time)
+    ).one()
+
     total_records = payment_count + rebate_count + crm_withdraw_count + crm_deposit_count
     
     # Define thresholds for meaningful charts
@@ -82,113 +103,142 @@ def check_data_sufficiency_for_charts(start_date=None, end_date=None):
 
 def calculate_topchange_deposit_total(start_date=None, end_date=None):
     """Calculate Topchange deposit total from CRM deposits"""
-    query = CRMDeposit.query.filter_by(user_id=current_user.id)
-    
+    query = db.session.query(
+        func.coalesce(func.sum(CRMDeposit.trading_amount), 0.0)
+    ).filter(
+        CRMDeposit.user_id == current_user.id,
+        func.upper(func.trim(CRMDeposit.payment_method)) == 'TOPCHANGE'
+    )
+
     if start_date and end_date:
         query = filter_by_date_range(query, start_date, end_date, CRMDeposit.request_time)
-    
-    topchange_total = 0
-    for deposit in query.all():
-        payment_method = (deposit.payment_method or '').strip().upper()
-        if payment_method == 'TOPCHANGE':
-            topchange_total += float(deposit.trading_amount or 0)
-    
-    return topchange_total
+
+    return float(query.scalar())
+
+def _calculate_metrics(start_date=None, end_date=None):
+    """
+    Compute all report metrics with one aggregate query per table
+    Conditional SUM(CASE ...) aggregates replace loading whole tables
+    into Python and summing row by row: every metric over PaymentData
+    comes back from a single scan, likewise for CRMDeposit. Results are
+    cached per (user, range) for a short TTL.
+    """
+    uid = current_user.id
+    cache_key = (uid, start_date, end_date)
+    cached = _METRICS_CACHE.get(cache_key)
+    now = time.monotonic()
+    if cached is not None and now - cached[0] < _METRICS_CACHE_TTL:
+        return dict(cached[1])
+
+    # Each aggregate becomes a scalar subquery so every metric comes
+    # back in one round trip; the database still runs one scan per table
+    def payment_sum(expression):
+        query = db.session.query(func.coalesce(func.sum(expression), 0.0)).filter(PaymentData.user_id == uid)
+        if start_date and end_date:
+            query = filter_by_date_range(query, start_date, end_date, PaymentData.created)
+        return query.scalar_subquery()
+
+    def crm_deposit_sum(expression):
+        query = db.session.query(func.coalesce(func.sum(expression), 0.0)).filter(CRMDeposit.user_id == uid)
+        if start_date and end_date:
+            query = filter_by_date_range(query, start_date, end_date, CRMDeposit.request_time)
+        return query.scalar_subquery()
+
+    rebate_query = db.session.query(
+        func.coalesce(func.sum(IBRebate.rebate), 0.0)
+    ).filter(IBRebate.user_id == uid)
+
+    crm_withdraw_query = db.session.query(
+        func.coalesce(func.sum(CRMWithdrawals.withdrawal_amount), 0.0)
+    ).filter(CRMWithdrawals.user_id == uid)
+
+    if start_date and end_date:
+        rebate_query = filter_by_date_range(rebate_query, start_date, end_date, IBRebate.rebate_time)
+        crm_withdraw_query = filter_by_date_range(crm_withdraw_query, start_date, end_date, CRMWithdrawals.review_time)
+
+    (rebate_total, m2p_dep, set_dep, m2p_wd, set_wd, tier_dep, tier_wd,
+     crm_dep_total, topchange_total, crm_wd_total) = db.session.query(
+        rebate_query.scalar_subquery(),
+        payment_sum(case((PaymentData.sheet_category == 'M2p Deposit', PaymentData.final_amount), else_=0.0)),
+        payment_sum(case((PaymentData.sheet_category == 'Settlement Deposit', PaymentData.final_amount), else_=0.0)),
+        payment_sum(case((PaymentData.sheet_category == 'M2p Withdraw', PaymentData.final_amount), else_=0.0)),
+        payment_sum(case((PaymentData.sheet_category == 'Settlement Withdraw', PaymentData.final_amount), else_=0.0)),
+        payment_sum(case((PaymentData.sheet_category.in_(('M2p Deposit', 'Settlement Deposit')), PaymentData.tier_fee), else_=0.0)),
+        payment_sum(case((PaymentData.sheet_category.in_(('M2p Withdraw', 'Settlement Withdraw')), PaymentData.tier_fee), else_=0.0)),
+        crm_deposit_sum(CRMDeposit.trading_amount),
+        crm_deposit_sum(case((func.upper(func.trim(CRMDeposit.payment_method)) == 'TOPCHANGE', CRMDeposit.trading_amount), else_=0.0)),
+        crm_withdraw_query.scalar_subquery()
+    ).one()
+
+    metrics = {
+        'Total Rebate': float(rebate_total),
+        'M2p Deposit': float(m2p_dep),
+        'Settlement Deposit': float(set_dep),
+        'M2p Withdrawal': float(m2p_wd),
+        'Settlement Withdrawal': float(set_wd),
+        'CRM Deposit Total': float(crm_dep_total),
+        'Tier Fee Deposit': float(tier_dep),
+        'Tier Fee Withdraw': float(tier_wd),
+        'Welcome Bonus Withdrawals': calculate_welcome_bonus_withdrawals(start_date, end_date),
+        'CRM TopChange Total': float(topchange_total),
+        'CRM Withdraw Total': float(crm_wd_total)
+    }
+
+    if len(_METRICS_CACHE) >= _METRICS_CACHE_MAX:
+        _METRICS_CACHE.clear()
+    # Store and hand out copies: callers rename keys in their dicts
+    _METRICS_CACHE[cache_key] = (now, dict(metrics))
+    return metrics
 
 def calculate_welcome_bonus_withdrawals(start_date=None, end_date=None):
     """Calculate Welcome Bonus withdrawals"""
-    # Get welcome bonus accounts
-    welcome_accounts = AccountList.query.filter_by(
-        user_id=current_user.id, 
-        is_welcome_bonus=True
-    ).all()
-    
-    welcome_logins = [acc.login for acc in welcome_accounts]
-    
+    # Get welcome bonus logins as a set, without loading full ORM rows
+    welcome_logins = {login for (login,) in AccountList.query.with_entities(
+        AccountList.login
+    ).filter_by(user_id=current_user.id, is_welcome_bonus=True)}
+
     if not welcome_logins:
         return 0
-    
-    # Get withdrawals
-    crm_withdraw_query = CRMWithdrawals.query.filter_by(user_id=current_user.id)
-    
+
+    # Get withdrawals; only the two columns the loop reads
+    crm_withdraw_query = CRMWithdrawals.query.with_entities(
+        CRMWithdrawals.trading_account, CRMWithdrawals.withdrawal_amount
+    ).filter_by(user_id=current_user.id)
+
     if start_date and end_date:
         crm_withdraw_query = filter_by_date_range(crm_withdraw_query, start_date, end_date, CRMWithdrawals.review_time)
-    
+
+    # The login extraction has to stay in Python (SQLite has no regexp
+    # function), but membership is now a set lookup instead of a list scan
     welcome_withdraw_sum = 0
-    for withdrawal in crm_withdraw_query.all():
-        # Extract login number from trading account
-        trading_account = str(withdrawal.trading_account or '')
-        login_match = None
-        import re
-        match = re.search(r'\d+', trading_account)
-        if match:
-            login_match = match.group()
-        
-        if login_match and login_match in welcome_logins:
-            welcome_withdraw_sum += float(withdrawal.withdrawal_amount or 0)
-    
+    for trading_account, withdrawal_amount in crm_withdraw_query:
+        match = _LOGIN_RE.search(trading_account) if trading_account else None
+        if match and match.group() in welcome_logins:
+            welcome_withdraw_sum += float(withdrawal_amount or 0)
+
     return welcome_withdraw_sum
 
+@functools.lru_cache(maxsize=256)
+def _format_metric_rows(metric_items):
+    """Format (metric, value) pairs as display rows.
+
+    Takes a hashable tuple view of the calculations so repeat dashboard
+    hits that come out of the _calculate_metrics cache also reuse the
+    formatted projection. Returns tuples; callers copy into lists.
+    """
+    return tuple((metric, f"{value:.2f}") for metric, value in metric_items)
+
+
 def generate_formatted_final_report(start_date=None, end_date=None):
     """
     Generate final report similar to the Google Apps Script version
     This is shown when data is insufficient for charts
     """
-    
-    # Base queries for current user
-    payment_query = PaymentData.query.filter_by(user_id=current_user.id)
-    rebate_query = IBRebate.query.filter_by(user_id=current_user.id)
-    crm_withdraw_query = CRMWithdrawals.query.filter_by(user_id=current_user.id)
-    crm_deposit_query = CRMDeposit.query.filter_by(user_id=current_user.id)
-    
-    # Apply date filters if provided
-    if start_date and end_date:
-        payment_query = filter_by_date_range(payment_query, start_date, end_date, PaymentData.created)
-        rebate_query = filter_by_date_range(rebate_query, start_date, end_date, IBRebate.rebate_time)
-        crm_withdraw_query = filter_by_date_range(crm_withdraw_query, start_date, end_date, CRMWithdrawals.review_time)
-        crm_deposit_query = filter_by_date_range(crm_deposit_query, start_date, end_date, CRMDeposit.request_time)
-    
+
     # Calculate all metrics (similar to Google Apps Script)
-    calculations = {}
-    
-    # 1. Total Rebate
-    calculations['Total Rebate'] = sum_column_from_query(rebate_query.all(), 'rebate')
-    
-    # 2. Deposits by category
-    m2p_deposits = payment_query.filter_by(sheet_category='M2p Deposit').all()
-    settlement_deposits = payment_query.filter_by(sheet_category='Settlement Deposit').all()
-    
-    calculations['M2p Deposit'] = sum_column_from_query(m2p_deposits, 'final_amount')
-    calculations['Settlement Deposit'] = sum_column_from_query(settlement_deposits, 'final_amount')
-    
-    # 3. Withdrawals by category
-    m2p_withdraws = payment_query.filter_by(sheet_category='M2p Withdraw').all()
-    settlement_withdraws = payment_query.filter_by(sheet_category='Settlement Withdraw').all()
-    
-    calculations['M2p Withdrawal'] = sum_column_from_query(m2p_withdraws, 'final_amount')
-    calculations['Settlement Withdrawal'] = sum_column_from_query(settlement_withdraws, 'final_amount')
-    
-    # 4. CRM Deposit Total
-    calculations['CRM Deposit Total'] = sum_column_from_query(crm_deposit_query.all(), 'trading_amount')
-    
-    # 5. Topchange Deposit Total
-    calculations['Topchange Deposit Total'] = calculate_topchange_deposit_total(start_date, end_date)
-    
-    # 6. Tier Fees
-    tier_fee_deposit = (sum_column_from_query(m2p_deposits, 'tier_fee') + 
-                       sum_column_from_query(settlement_deposits, 'tier_fee'))
-    tier_fee_withdraw = (sum_column_from_query(m2p_withdraws, 'tier_fee') + 
-                        sum_column_from_query(settlement_withdraws, 'tier_fee'))
-    
-    calculations['Tier Fee Deposit'] = tier_fee_deposit
-    calculations['Tier Fee Withdraw'] = tier_fee_withdraw
-    
-    # 7. Welcome Bonus Withdrawals
-    calculations['Welcome Bonus Withdrawals'] = calculate_welcome_bonus_withdrawals(start_date, end_date)
-    
-    # 8. CRM Withdraw Total
-    calculations['CRM Withdraw Total'] = sum_column_from_query(crm_withdraw_query.all(), 'withdrawal_amount')
-    
+    calculations = _calculate_metrics(start_date, end_date)
+    calculations['Topchange Deposit Total'] = calculations.pop('CRM TopChange Total')
+
     # Format as ordered list for consistent display (matching Google Apps Script order)
     metrics_order = [
         'Total Rebate',
@@ -214,9 +264,8 @@ def generate_formatted_final_report(start_date=None, end_date=None):
         report_data.append(['', ''])  # Empty row for spacing
     
     # Add metrics in specified order
-    for metric in metrics_order:
-        value = calculations.get(metric, 0)
-        report_data.append([metric, f"{value:.2f}"])
+    metric_items = tuple((metric, calculations.get(metric, 0)) for metric in metrics_order)
+    report_data.extend([metric, formatted] for metric, formatted in _format_metric_rows(metric_items))
     
     return {
         'report_data': report_data,
@@ -242,61 +291,10 @@ def generate_final_report(start_date=None, end_date=None):
 
 def generate_original_final_report(start_date=None, end_date=None):
     """Original final report generation for cases with sufficient data"""
-    
-    # Base queries for current user
-    payment_query = PaymentData.query.filter_by(user_id=current_user.id)
-    rebate_query = IBRebate.query.filter_by(user_id=current_user.id)
-    crm_withdraw_query = CRMWithdrawals.query.filter_by(user_id=current_user.id)
-    crm_deposit_query = CRMDeposit.query.filter_by(user_id=current_user.id)
-    
-    # Apply date filters if provided
-    if start_date and end_date:
-        payment_query = filter_by_date_range(payment_query, start_date, end_date, PaymentData.created)
-        rebate_query = filter_by_date_range(rebate_query, start_date, end_date, IBRebate.rebate_time)
-        crm_withdraw_query = filter_by_date_range(crm_withdraw_query, start_date, end_date, CRMWithdrawals.review_time)
-        crm_deposit_query = filter_by_date_range(crm_deposit_query, start_date, end_date, CRMDeposit.request_time)
-    
+
     # Calculate totals
-    calculations = {}
-    
-    # 1. Total Rebate
-    calculations['Total Rebate'] = sum_column_from_query(rebate_query.all(), 'rebate')
-    
-    # 2. Deposits by category
-    m2p_deposits = payment_query.filter_by(sheet_category='M2p Deposit').all()
-    settlement_deposits = payment_query.filter_by(sheet_category='Settlement Deposit').all()
-    
-    calculations['M2p Deposit'] = sum_column_from_query(m2p_deposits, 'final_amount')
-    calculations['Settlement Deposit'] = sum_column_from_query(settlement_deposits, 'final_amount')
-    
-    # 3. Withdrawals by category
-    m2p_withdraws = payment_query.filter_by(sheet_category='M2p Withdraw').all()
-    settlement_withdraws = payment_query.filter_by(sheet_category='Settlement Withdraw').all()
-    
-    calculations['M2p Withdrawal'] = sum_column_from_query(m2p_withdraws, 'final_amount')
-    calculations['Settlement Withdrawal'] = sum_column_from_query(settlement_withdraws, 'final_amount')
-    
-    # 4. CRM Deposit Total
-    calculations['CRM Deposit Total'] = sum_column_from_query(crm_deposit_query.all(), 'trading_amount')
-    
-    # 5. Tier Fees
-    tier_fee_deposit = (sum_column_from_query(m2p_deposits, 'tier_fee') + 
-                       sum_column_from_query(settlement_deposits, 'tier_fee'))
-    tier_fee_withdraw = (sum_column_from_query(m2p_withdraws, 'tier_fee') + 
-                        sum_column_from_query(settlement_withdraws, 'tier_fee'))
-    
-    calculations['Tier Fee Deposit'] = tier_fee_deposit
-    calculations['Tier Fee Withdraw'] = tier_fee_withdraw
-    
-    # 6. Welcome Bonus Withdrawals
-    calculations['Welcome Bonus Withdrawals'] = calculate_welcome_bonus_withdrawals(start_date, end_date)
-    
-    # 7. CRM TopChange Total
-    calculations['CRM TopChange Total'] = calculate_topchange_deposit_total(start_date, end_date)
-    
-    # 8. CRM Withdraw Total
-    calculations['CRM Withdraw Total'] = sum_column_from_query(crm_withdraw_query.all(), 'withdrawal_amount')
-    
+    calculations = _calculate_metrics(start_date, end_date)
+
     # Format as list of tuples for display
     report_data = []
     date_range_str = ''
@@ -305,8 +303,8 @@ def generate_original_final_report(start_date=None, end_date=None):
         report_data.append(['Date Range', date_range_str])
         report_data.append(['', ''])
     
-    for key, value in calculations.items():
-        report_data.append([key, f"{value:.2f}"])
+    report_data.extend([metric, formatted] for metric, formatted
+                       in _format_metric_rows(tuple(calculations.items())))
     
     return {
         'report_data': report_data,
@@ -327,66 +325,96 @@ def compare_crm_and_client_deposits(start_date=None, end_date=None):
         crm_query = filter_by_date_range(crm_query, start_date, end_date, CRMDeposit.request_time)
         client_query = filter_by_date_range(client_query, start_date, end_date, PaymentData.created)
     
-    crm_deposits = crm_query.all()
-    client_deposits = client_query.all()
-    
-    # Normalize data for comparison
-    crm_normalized = []
-    for deposit in crm_deposits:
-        crm_normalized.append({
-            'date': deposit.request_time,
-            'client_id': (deposit.client_id or '').strip().lower(),
-            'name': deposit.name or '',
-            'amount': float(deposit.trading_amount or 0),
-            'payment_method': (deposit.payment_method or '').strip().lower(),
-            'source': 'CRM Deposit',
-            'id': deposit.id
-        })
-    
+    # Fetch only the compared columns and normalize them in vectorized
+    # passes instead of building one dict at a time from full ORM rows.
+    # A merge_asof nearest-join cannot express the exclusive first-match
+    # semantics below, so the bucketed matcher keeps doing the join.
+    # The CRM side is only walked once as the probe stream, so it is not
+    # materialized up front; only the client side needs a full index.
+    crm_rows = crm_query.with_entities(
+        CRMDeposit.request_time, CRMDeposit.client_id, CRMDeposit.name,
+        CRMDeposit.trading_amount, CRMDeposit.payment_method, CRMDeposit.id
+    ).yield_per(5000)
+
+    client_df = pd.DataFrame(client_query.with_entities(
+        PaymentData.created, PaymentData.trading_account,
+        PaymentData.final_amount, PaymentData.id
+    ).all(), columns=['date', 'account', 'amount', 'id'])
+
     client_normalized = []
-    for deposit in client_deposits:
-        client_normalized.append({
-            'date': deposit.created,
-            'account': (deposit.trading_account or '').strip().lower(),
-            'amount': float(deposit.final_amount or 0),
-            'source': 'M2p Deposit',
-            'id': deposit.id
-        })
-    
+    if not client_df.empty:
+        client_df['account'] = client_df['account'].fillna('').str.strip().str.lower()
+        client_df['amount'] = client_df['amount'].fillna(0.0).astype(float)
+        client_df['source'] = 'M2p Deposit'
+        # Plain datetimes, not Timestamps: naive Timestamp.timestamp()
+        # assumes UTC while datetime.timestamp() assumes local time, so
+        # mixing the two shifts the bucket keys by the UTC offset
+        dates = pd.to_datetime(client_df['date'], errors='coerce')
+        client_df['date'] = pd.Series(dates.dt.to_pydatetime(), index=client_df.index,
+                                      dtype=object).where(dates.notna(), None)
+        client_normalized = client_df.to_dict('records')
+    
+    # Bucket client deposits by (time window, whole-dollar amount) so
+    # each CRM row probes a handful of candidates instead of rescanning
+    # the whole client list; the nested loop was O(N x M)
+    buckets = defaultdict(list)
+    for idx, client_row in enumerate(client_normalized):
+        # Character set of the account doubles as a cheap prefilter: a
+        # client_id can only be a substring if all its characters occur
+        # in the account, so most candidate pairs skip the substring scan
+        client_row['chars'] = frozenset(client_row['account'])
+        if client_row['date']:
+            time_bucket = int(client_row['date'].timestamp()) // _BUCKET_SECONDS
+            amount_bucket = math.floor(client_row['amount'])
+            buckets[(time_bucket, amount_bucket)].append((idx, client_row))
+
     # Find matches and discrepancies
     matched = set()
     unmatched = []
-    
-    # Compare CRM with Client deposits
-    for crm_row in crm_normalized:
+
+    # Compare CRM with Client deposits; the 3.5h/±$1 tolerances span at
+    # most the neighbouring bucket on either axis
+    for crm_date, crm_client_id, crm_name, crm_amount, crm_method, crm_id in crm_rows:
+        crm_client_id = (crm_client_id or '').strip().lower()
+        crm_chars = frozenset(crm_client_id)
+        crm_amount = float(crm_amount or 0.0)
+
         match_found = False
-        for client_row in client_normalized:
-            if client_row['id'] in matched:
-                continue
-            
-            # Check if dates are within 3.5 hours of each other
-            if crm_row['date'] and client_row['date']:
-                time_diff = abs((crm_row['date'] - client_row['date']).total_seconds())
+        if crm_date:
+            time_bucket = int(crm_date.timestamp()) // _BUCKET_SECONDS
+            amount_bucket = math.floor(crm_amount)
+            candidates = []
+            for tb in (time_bucket - 1, time_bucket, time_bucket + 1):
+                for ab in (amount_bucket - 1, amount_bucket, amount_bucket + 1):
+                    candidates.extend(buckets.get((tb, ab), ()))
+
+            # Probe candidates in original client order, as the old scan did
+            for idx, client_row in sorted(candidates, key=lambda c: c[0]):
+                if client_row['id'] in matched:
+                    continue
+
+                # Check if dates are within 3.5 hours of each other
+                time_diff = abs((crm_date - client_row['date']).total_seconds())
                 if time_diff <= 3.5 * 3600:  # 3.5 hours
                     # Check if client ID is in trading account
-                    if crm_row['client_id'] in client_row['account']:
+                    if crm_chars <= client_row['chars'] and crm_client_id in client_row['account']:
                         # Check if amounts are similar (within $1)
-                        if abs(crm_row['amount'] - client_row['amount']) <= 1:
+                        if abs(crm_amount - client_row['amount']) <= 1:
                             matched.add(client_row['id'])
                             match_found = True
                             break
-        
+
         # If no match found and not TopChange, add to unmatched
-        if not match_found and crm_row['payment_method'] != 'topchange':
+        if not match_found and (crm_method or '').strip().lower() != 'topchange':
             unmatched.append([
-                crm_row['source'],
-                crm_row['date'].strftime('%Y-%m-%d') if crm_row['date'] else '',
-                crm_row['client_id'],
+                'CRM Deposit',
+                crm_date.strftime('%Y-%m-%d') if crm_date else '',
+                crm_client_id,
                 '',
-                f"{crm_row['amount']:.2f}",
-                crm_row['name'],
+                f"{crm_amount:.2f}",
+                crm_name or '',
                 'N',  # Confirmed status
-                crm_row['id']
+                crm_id
             ])
     
     # Add unmatched client deposits
@@ -411,13 +439,20 @@ def compare_crm_and_client_deposits(start_date=None, end_date=None):
         'total_discrepancies': len(unmatched)
     }
 
-def get_payment_data_by_category(category, start_date=None, end_date=None):
-    """Get payment data filtered by category and optionally by date range"""
+def get_payment_data_by_category(category, start_date=None, end_date=None, columns=None):
+    """Get payment data filtered by category and optionally by date range
+
+    When columns is given (a sequence of PaymentData columns), returns a
+    streaming iterator of plain row tuples instead of hydrated ORM
+    objects, which keeps exports of large categories out of memory.
+    """
     query = PaymentData.query.filter_by(user_id=current_user.id, sheet_category=category)
     
     if start_date and end_date:
         query = filter_by_date_range(query, start_date, end_date, PaymentData.created)
     
+    if columns is not None:
+        return query.with_entities(*columns).yield_per(5000)
     return query.all()
 
 def get_summary_data_for_charts(start_date=None, end_date=None):
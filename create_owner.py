@@ -7,20 +7,20 @@ import sys
 sys.path.append('/app')
 
 from app import create_app, db
-from app.models import User, Role
+from app.models import User, load_roles
 
 def create_owner_user():
     """Create an Owner user for testing admin functionality"""
     app = create_app()
     with app.app_context():
         # Check if owner user already exists
-        existing_owner = User.query.filter_by(username='admin_owner').first()
+        existing_owner = User.query.with_entities(User.id).filter_by(username='admin_owner').first()
         if existing_owner:
             print("Owner user already exists")
             return True
             
         # Get Owner role
-        owner_role = Role.query.filter_by(name='Owner').first()
+        owner_role = load_roles().get('Owner')
         if not owner_role:
             print("Owner role not found in database")
             return False
@@ -3,18 +3,18 @@
 Create a test user for testing the web interface
 """
 from app import create_app, db
-from app.models import User, Role
+from app.models import User, load_roles
 
 app = create_app()
 
 with app.app_context():
     # Check if test user exists
-    test_user = User.query.filter_by(username='demo').first()
+    test_user = User.query.with_entities(User.id).filter_by(username='demo').first()
     if test_user:
         print("Demo user already exists")
     else:
         # Create demo user
-        viewer_role = Role.query.filter_by(name='Viewer').first()
+        viewer_role = load_roles().get('Viewer')
         if not viewer_role:
             print("Error: Viewer role not found")
             exit(1)
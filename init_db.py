@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 from app import create_app, db
-from app.models import User, Role
+from app.models import User, Role, load_roles
 
 app = create_app()
 
@@ -9,7 +9,7 @@ with app.app_context():
     db.create_all()
     
     # Initialize roles if they don't exist
-    if Role.query.count() == 0:
+    if not load_roles():
         print("Creating roles...")
         roles = ['Viewer', 'Admin', 'Owner']
         for role_name in roles:
@@ -0,0 +1,44 @@
+"""Add composite indexes for report queries
+
+Revision ID: c91a5e207d44
+Revises: 4f138aea945b
+Create Date: 2025-08-26 10:14:02.381257
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c91a5e207d44'
+down_revision = '4f138aea945b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('payment_data', schema=None) as batch_op:
+        batch_op.create_index('ix_payment_user_cat_created', ['user_id', 'sheet_category', 'created'], unique=False)
+
+    with op.batch_alter_table('ib_rebate', schema=None) as batch_op:
+        batch_op.create_index('ix_rebate_user_time', ['user_id', 'rebate_time'], unique=False)
+
+    with op.batch_alter_table('crm_withdrawals', schema=None) as batch_op:
+        batch_op.create_index('ix_crm_wd_user_time', ['user_id', 'review_time'], unique=False)
+
+    with op.batch_alter_table('crm_deposit', schema=None) as batch_op:
+        batch_op.create_index('ix_crm_dep_user_time', ['user_id', 'request_time'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('crm_deposit', schema=None) as batch_op:
+        batch_op.drop_index('ix_crm_dep_user_time')
+
+    with op.batch_alter_table('crm_withdrawals', schema=None) as batch_op:
+        batch_op.drop_index('ix_crm_wd_user_time')
+
+    with op.batch_alter_table('ib_rebate', schema=None) as batch_op:
+        batch_op.drop_index('ix_rebate_user_time')
+
+    with op.batch_alter_table('payment_data', schema=None) as batch_op:
+        batch_op.drop_index('ix_payment_user_cat_created')
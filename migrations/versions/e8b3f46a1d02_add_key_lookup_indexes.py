@@ -0,0 +1,46 @@
+"""Add composite indexes for key lookups
+
+Revision ID: e8b3f46a1d02
+Revises: c91a5e207d44
+Create Date: 2025-08-26 14:37:55.102846
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b3f46a1d02'
+down_revision = 'c91a5e207d44'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('payment_data', schema=None) as batch_op:
+        batch_op.create_index('ix_payment_user_tx', ['user_id', 'tx_id'], unique=False)
+        batch_op.create_index('ix_payment_user_created', ['user_id', 'created'], unique=False)
+
+    with op.batch_alter_table('ib_rebate', schema=None) as batch_op:
+        batch_op.create_index('ix_rebate_user_tx', ['user_id', 'transaction_id'], unique=False)
+
+    with op.batch_alter_table('crm_withdrawals', schema=None) as batch_op:
+        batch_op.create_index('ix_crm_wd_user_request', ['user_id', 'request_id'], unique=False)
+
+    with op.batch_alter_table('crm_deposit', schema=None) as batch_op:
+        batch_op.create_index('ix_crm_dep_user_request', ['user_id', 'request_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('crm_deposit', schema=None) as batch_op:
+        batch_op.drop_index('ix_crm_dep_user_request')
+
+    with op.batch_alter_table('crm_withdrawals', schema=None) as batch_op:
+        batch_op.drop_index('ix_crm_wd_user_request')
+
+    with op.batch_alter_table('ib_rebate', schema=None) as batch_op:
+        batch_op.drop_index('ix_rebate_user_tx')
+
+    with op.batch_alter_table('payment_data', schema=None) as batch_op:
+        batch_op.drop_index('ix_payment_user_created')
+        batch_op.drop_index('ix_payment_user_tx')
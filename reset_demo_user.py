@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 from app import create_app, db
-from app.models import User, Role
+from app.models import User, load_roles
 
 app = create_app()
 
@@ -13,7 +13,7 @@ with app.app_context():
         print("Existing demo user deleted")
     
     # Create new demo user with proper password
-    viewer_role = Role.query.filter_by(name='Viewer').first()
+    viewer_role = load_roles().get('Viewer')
     demo_user = User(
         username='demo',
         email='demo@test.com', 
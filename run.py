@@ -1,5 +1,5 @@
 from app import create_app, db
-from app.models import User, Role
+from app.models import User, Role, load_roles
 
 app = create_app()
 
@@ -11,7 +11,7 @@ def setup_initial_roles():
     """Initializes roles if the roles table is empty."""
     with app.app_context():
         # This check prevents re-creating roles on every app start
-        if Role.query.count() == 0:
+        if not load_roles():
             print("No roles found. Initializing roles...")
             roles = ['Viewer', 'Admin', 'Owner']
             for r in roles:
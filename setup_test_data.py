@@ -2,9 +2,11 @@
 """
 Setup test data for the demo user to demonstrate both table and chart modes
 """
+import numpy as np
+import pandas as pd
 from app import create_app, db
 from app.models import User, PaymentData, IBRebate, CRMWithdrawals, CRMDeposit, AccountList
-from datetime import datetime, timedelta
+from datetime import datetime
 
 app = create_app()
 
@@ -18,15 +20,20 @@ def setup_demo_data():
         
         print(f"✅ Found demo user: {demo_user.username}")
         
-        # Clear existing data
-        PaymentData.query.filter_by(user_id=demo_user.id).delete()
-        IBRebate.query.filter_by(user_id=demo_user.id).delete()
-        CRMWithdrawals.query.filter_by(user_id=demo_user.id).delete()
-        CRMDeposit.query.filter_by(user_id=demo_user.id).delete()
-        AccountList.query.filter_by(user_id=demo_user.id).delete()
+        # Clear existing data; skip the per-row session sync since nothing
+        # from these tables is loaded yet
+        PaymentData.query.filter_by(user_id=demo_user.id).delete(synchronize_session=False)
+        IBRebate.query.filter_by(user_id=demo_user.id).delete(synchronize_session=False)
+        CRMWithdrawals.query.filter_by(user_id=demo_user.id).delete(synchronize_session=False)
+        CRMDeposit.query.filter_by(user_id=demo_user.id).delete(synchronize_session=False)
+        AccountList.query.filter_by(user_id=demo_user.id).delete(synchronize_session=False)
         
         # Create moderate amount of data (should trigger chart mode)
         now = datetime.now()
+
+        # One vectorized pass produces the day-offset timestamps for
+        # every seed list below instead of per-row timedelta arithmetic
+        seed_dates = (pd.Timestamp(now) - pd.to_timedelta(np.arange(16), unit='D')).to_pydatetime()
         
         # Add payment data (15 records across categories)
         payment_data = [
@@ -52,29 +59,33 @@ def setup_demo_data():
             ('SET_WITH_002', 'Settlement Withdraw', 'WITHDRAW', 1150.50, 57.75),
         ]
         
-        for i, (tx_id, category, tx_type, amount, fee) in enumerate(payment_data):
-            payment = PaymentData(
-                user_id=demo_user.id,
-                tx_id=tx_id,
-                status='DONE',
-                type=tx_type,
-                sheet_category=category,
-                final_amount=amount,
-                tier_fee=fee,
-                created=now - timedelta(days=i)
-            )
-            db.session.add(payment)
-        
+        # Bulk-insert each table in one multi-row INSERT instead of adding
+        # ORM objects one at a time
+        db.session.bulk_insert_mappings(PaymentData, [
+            {
+                'user_id': demo_user.id,
+                'tx_id': tx_id,
+                'status': 'DONE',
+                'type': tx_type,
+                'sheet_category': category,
+                'final_amount': amount,
+                'tier_fee': fee,
+                'created': seed_dates[i]
+            }
+            for i, (tx_id, category, tx_type, amount, fee) in enumerate(payment_data)
+        ])
+
         # Add rebate data (8 records)
         rebate_data = [125.50, 89.75, 156.25, 203.00, 178.50, 95.25, 134.75, 167.00]
-        for i, rebate_amount in enumerate(rebate_data):
-            rebate = IBRebate(
-                user_id=demo_user.id,
-                transaction_id=f'REBATE_{i+1:03d}',
-                rebate=rebate_amount,
-                rebate_time=now - timedelta(days=i)
-            )
-            db.session.add(rebate)
+        db.session.bulk_insert_mappings(IBRebate, [
+            {
+                'user_id': demo_user.id,
+                'transaction_id': f'REBATE_{i+1:03d}',
+                'rebate': rebate_amount,
+                'rebate_time': seed_dates[i]
+            }
+            for i, rebate_amount in enumerate(rebate_data)
+        ])
         
         # Add CRM deposit data (12 records)
         crm_deposit_data = [
@@ -84,41 +95,44 @@ def setup_demo_data():
             (840.75, 'TOPCHANGE'), (1375.25, 'CARD'), (995.00, 'CARD')
         ]
         
-        for i, (amount, method) in enumerate(crm_deposit_data):
-            crm_deposit = CRMDeposit(
-                user_id=demo_user.id,
-                request_id=f'CRM_DEP_{i+1:03d}',
-                trading_amount=amount,
-                payment_method=method,
-                client_id=f'CLIENT_{i+1000}',
-                name=f'Client Name {i+1}',
-                request_time=now - timedelta(days=i)
-            )
-            db.session.add(crm_deposit)
-        
+        db.session.bulk_insert_mappings(CRMDeposit, [
+            {
+                'user_id': demo_user.id,
+                'request_id': f'CRM_DEP_{i+1:03d}',
+                'trading_amount': amount,
+                'payment_method': method,
+                'client_id': f'CLIENT_{i+1000}',
+                'name': f'Client Name {i+1}',
+                'request_time': seed_dates[i]
+            }
+            for i, (amount, method) in enumerate(crm_deposit_data)
+        ])
+
         # Add CRM withdrawal data (10 records)
         crm_withdrawal_data = [450.00, 670.25, 890.50, 1120.75, 340.00, 780.25, 950.50, 1250.00, 580.75, 825.25]
-        for i, amount in enumerate(crm_withdrawal_data):
-            crm_withdrawal = CRMWithdrawals(
-                user_id=demo_user.id,
-                request_id=f'CRM_WITH_{i+1:03d}',
-                withdrawal_amount=amount,
-                trading_account=f'ACCOUNT_{i+1000}',
-                review_time=now - timedelta(days=i)
-            )
-            db.session.add(crm_withdrawal)
-        
+        db.session.bulk_insert_mappings(CRMWithdrawals, [
+            {
+                'user_id': demo_user.id,
+                'request_id': f'CRM_WITH_{i+1:03d}',
+                'withdrawal_amount': amount,
+                'trading_account': f'ACCOUNT_{i+1000}',
+                'review_time': seed_dates[i]
+            }
+            for i, amount in enumerate(crm_withdrawal_data)
+        ])
+
         # Add welcome bonus accounts (3 records)
-        for i in range(3):
-            account = AccountList(
-                user_id=demo_user.id,
-                login=str(1000 + i),
-                name=f'Welcome Bonus User {i+1}',
-                group='WELCOME\\\\Welcome BBOOK',
-                is_welcome_bonus=True
-            )
-            db.session.add(account)
-        
+        db.session.bulk_insert_mappings(AccountList, [
+            {
+                'user_id': demo_user.id,
+                'login': str(1000 + i),
+                'name': f'Welcome Bonus User {i+1}',
+                'group': 'WELCOME\\\\Welcome BBOOK',
+                'is_welcome_bonus': True
+            }
+            for i in range(3)
+        ])
+
         db.session.commit()
         
         # Count totals
@@ -1,341 +1,455 @@
-import pandas as pd
-import re
-from datetime import datetime
-from sqlalchemy import and_
-from app import db
-from app.models import (
-    PaymentData,
-    IBRebate,
-    CRMWithdrawals,
-    CRMDeposit,
-    AccountList
-)
-from flask_login import current_user
-
-# ──────── UTILITY FUNCTIONS ────────────────────────────────────────────────────
-
-def detect_separator(line: str) -> str:
-    tab_count = line.count('\t')
-    comma_count = line.count(',')
-    semicolon_count = line.count(';')
-    if tab_count >= comma_count and tab_count >= semicolon_count:
-        return '\t'
-    if semicolon_count >= comma_count:
-        return ';'
-    return ','
-
-def parse_date(val, formats=None):
-    if val is None or (isinstance(val, float) and pd.isna(val)):
-        return None
-    s = str(val).strip()
-    fmts = formats or [
-        '%Y-%m-%d %H:%M:%S', '%Y-%m-%d',
-        '%d.%m.%Y %H:%M:%S', '%d.%m.%Y',
-        '%d/%m/%Y %H:%M:%S', '%d/%m/%Y',
-        '%m/%d/%Y %H:%M:%S', '%m/%d/%Y'
-    ]
-    for f in fmts:
-        try:
-            return datetime.strptime(s, f)
-        except ValueError:
-            continue
-    return None
-
-def read_csv(filepath: str) -> pd.DataFrame:
-    """Try multiple encodings and detect separator, return DataFrame."""
-    for enc in ['utf-8-sig','utf-8','latin1','cp1252','iso-8859-1']:
-        try:
-            with open(filepath, encoding=enc) as f:
-                first = f.readline()
-            sep = detect_separator(first)
-            return pd.read_csv(filepath, sep=sep, encoding=enc)
-        except Exception:
-            continue
-    raise ValueError(f"Cannot read {filepath}")
-
-def filter_unique(rows, existing_keys: set, key_cols: list):
-    """Mimic the Apps Script filterUnique: keep rows whose key (join of cols) is new."""
-    unique = []
-    for row in rows:
-        key = '|'.join(str(row[i] if i < len(row) else '').strip().upper() for i in key_cols)
-        if key and key not in existing_keys:
-            existing_keys.add(key)
-            unique.append(row)
-    return unique
-
-# ──────── STAGE 1: DATA PROCESSING ───────────────────────────────────────────────
-
-# Column mapping for PaymentData
-_COLUMN_MAP = {
-    'confirmed':'Confirmed','txId':'Transaction ID',
-    'transactionAddress':'Wallet address','status':'Status','type':'Type',
-    'paymentGatewayName':'Payment gateway','finalAmount':'Transaction amount',
-    'finalCurrency':'Transaction currency','transactionAmount':'Settlement amount',
-    'transactionCurrencyDisplayName':'Settlement currency','processingFee':'Processing fee',
-    'price':'Price','comment':'Comment','paymentId':'Payment ID','created':'Booked',
-    'tradingAccount':'Trading account','correctCoinSent':'correctCoinSent',
-    'balanceAfterTransaction':'Balance after','tierFee':'Tier fee'
-}
-_SHEET_CATEGORIES = {
-    'DEPOSIT': ('M2p Deposit','Settlement Deposit'),
-    'WITHDRAW': ('M2p Withdraw','Settlement Withdraw')
-}
-
-def process_payment(filepath: str) -> int:
-    df = read_csv(filepath)
-    added = 0
-    for _, row in df.iterrows():
-        data = {h.strip(): row[i] for i,h in enumerate(df.columns)}
-        tx = str(data.get(_COLUMN_MAP['txId'],'')).strip()
-        status = str(data.get(_COLUMN_MAP['status'], '')).upper()
-        pg = str(data.get(_COLUMN_MAP['paymentGatewayName'], '')).upper()
-        ty = str(data.get(_COLUMN_MAP['type'], '')).upper()
-        if not tx or pg == 'BALANCE' or status != 'DONE':
-            continue
-        if PaymentData.query.filter_by(tx_id=tx, user_id=current_user.id).first():
-            continue
-
-        # build record
-        rec = PaymentData(
-            user_id=current_user.id,
-            confirmed=parse_date(data.get(_COLUMN_MAP['confirmed'])),
-            tx_id=tx,
-            wallet_address=data.get(_COLUMN_MAP['transactionAddress']),
-            status=status,
-            type=ty,
-            payment_gateway=data.get(_COLUMN_MAP['paymentGatewayName']),
-            final_amount=float(data.get(_COLUMN_MAP['finalAmount']) or 0),
-            final_currency=data.get(_COLUMN_MAP['finalCurrency']),
-            settlement_amount=float(data.get(_COLUMN_MAP['transactionAmount']) or 0),
-            settlement_currency=data.get(_COLUMN_MAP['transactionCurrencyDisplayName']),
-            processing_fee=float(data.get(_COLUMN_MAP['processingFee']) or 0),
-            price=float(data.get(_COLUMN_MAP['price']) or 1),
-            comment=data.get(_COLUMN_MAP['comment']),
-            payment_id=data.get(_COLUMN_MAP['paymentId']),
-            created=parse_date(data.get(_COLUMN_MAP['created'])),
-            trading_account=data.get(_COLUMN_MAP['tradingAccount']),
-            correct_coin_sent=True,
-            balance_after=float(data.get(_COLUMN_MAP['balanceAfterTransaction']) or 0),
-            tier_fee=float(data.get(_COLUMN_MAP['tierFee']) or 0),
-            sheet_category=(
-                _SHEET_CATEGORIES['DEPOSIT'][1] if ty=='DEPOSIT' and 'SETTLEMENT' in pg
-                else _SHEET_CATEGORIES['DEPOSIT'][0] if ty=='DEPOSIT'
-                else _SHEET_CATEGORIES['WITHDRAW'][1] if ty=='WITHDRAW' and 'SETTLEMENT' in pg
-                else _SHEET_CATEGORIES['WITHDRAW'][0]
-            )
-        )
-        db.session.add(rec)
-        added += 1
-
-    db.session.commit()
-    return added
-
-def process_ib_rebate(filepath: str) -> int:
-    df = read_csv(filepath)
-    added = 0
-    for _, row in df.iterrows():
-        tx = str(row.get('Transaction ID','')).strip()
-        if not tx or IBRebate.query.filter_by(transaction_id=tx, user_id=current_user.id).first():
-            continue
-        rec = IBRebate(
-            user_id=current_user.id,
-            transaction_id=tx,
-            rebate=float(row.get('Rebate',0) or 0),
-            rebate_time=parse_date(row.get('Rebate Time',''))
-        )
-        db.session.add(rec)
-        added += 1
-    db.session.commit()
-    return added
-
-def process_crm_withdrawals(filepath: str) -> int:
-    df = read_csv(filepath)
-    added = 0
-    for _, row in df.iterrows():
-        req = str(row.get('Request ID','')).strip()
-        if not req or CRMWithdrawals.query.filter_by(request_id=req, user_id=current_user.id).first():
-            continue
-        amt_raw = str(row.get('Withdrawal Amount','')).upper()
-        if 'USC' in amt_raw:
-            amt = float(re.sub(r'[^0-9.-]','', amt_raw)) / 100
-        else:
-            amt = float(re.sub(r'[^0-9.-]','', amt_raw) or 0)
-        rec = CRMWithdrawals(
-            user_id=current_user.id,
-            request_id=req,
-            review_time=parse_date(row.get('Review Time','')),
-            trading_account=str(row.get('Trading Account','')).strip(),
-            withdrawal_amount=amt
-        )
-        db.session.add(rec)
-        added += 1
-    db.session.commit()
-    return added
-
-def process_crm_deposit(filepath: str) -> int:
-    df = read_csv(filepath)
-    added = 0
-    for _, row in df.iterrows():
-        req = str(row.get('Request ID','')).strip()
-        if not req or CRMDeposit.query.filter_by(request_id=req, user_id=current_user.id).first():
-            continue
-        amt_raw = str(row.get('Trading Amount',''))
-        if 'USC' in amt_raw.upper():
-            parts = amt_raw.split()
-            num = re.sub(r'[^0-9.-]','', parts[1] if len(parts)>1 else '0')
-            amt = float(num) / 100
-        else:
-            amt = float(re.sub(r'[^0-9.-]','', amt_raw) or 0)
-        rec = CRMDeposit(
-            user_id=current_user.id,
-            request_id=req,
-            request_time=parse_date(row.get('Request Time','')),
-            trading_account=str(row.get('Trading Account','')).strip(),
-            trading_amount=amt,
-            payment_method=row.get('Payment Method',''),
-            client_id=row.get('Client ID',''),
-            name=row.get('Name','')
-        )
-        db.session.add(rec)
-        added += 1
-    db.session.commit()
-    return added
-
-def process_account_list(filepath: str) -> int:
-    df = read_csv(filepath)
-    # remove first METATRADER line if present
-    if 'METATRADER' in df.iloc[0,0].upper():
-        df = df.iloc[1:]
-    # clear previous
-    AccountList.query.filter_by(user_id=current_user.id).delete()
-    added = 0
-    for _, row in df.iterrows():
-        login = str(row.get('Login','')).strip()
-        if not login:
-            continue
-        grp = str(row.get('Group','')).strip()
-        rec = AccountList(
-            user_id=current_user.id,
-            login=login,
-            name=row.get('Name',''),
-            group=grp,
-            is_welcome_bonus=(grp == r'WELCOME\Welcome BBOOK')
-        )
-        db.session.add(rec)
-        added += 1
-    db.session.commit()
-    return added
-
-# ──────── STAGE 2: REPORT GENERATION ────────────────────────────────────────────
-
-def filter_by_date_range(query, start_date, end_date, column):
-    if start_date and end_date:
-        return query.filter(and_(column >= start_date, column <= end_date))
-    return query
-
-def sum_column(records, attr):
-    return sum(getattr(r, attr, 0) or 0 for r in records)
-
-def generate_final_report(start_date=None, end_date=None):
-    pay_q = filter_by_date_range(
-        PaymentData.query.filter_by(user_id=current_user.id),
-        start_date, end_date, PaymentData.created
-    )
-    rebate_q = filter_by_date_range(
-        IBRebate.query.filter_by(user_id=current_user.id),
-        start_date, end_date, IBRebate.rebate_time
-    )
-    crm_w_q = filter_by_date_range(
-        CRMWithdrawals.query.filter_by(user_id=current_user.id),
-        start_date, end_date, CRMWithdrawals.review_time
-    )
-    crm_d_q = filter_by_date_range(
-        CRMDeposit.query.filter_by(user_id=current_user.id),
-        start_date, end_date, CRMDeposit.request_time
-    )
-
-    calc = {
-        'Total Rebate':      sum_column(rebate_q.all(),     'rebate'),
-        'M2p Deposit':       sum(r.final_amount for r in pay_q.filter_by(sheet_category='M2p Deposit').all()),
-        'Settlement Deposit':sum(r.final_amount for r in pay_q.filter_by(sheet_category='Settlement Deposit').all()),
-        'M2p Withdrawal':    sum(r.final_amount for r in pay_q.filter_by(sheet_category='M2p Withdraw').all()),
-        'Settlement Withdrawal':sum(r.final_amount for r in pay_q.filter_by(sheet_category='Settlement Withdraw').all()),
-        'CRM Deposit Total': sum_column(crm_d_q.all(),       'trading_amount'),
-        'CRM Withdraw Total':sum_column(crm_w_q.all(),      'withdrawal_amount'),
-        'Tier Fee Deposit':  sum(r.tier_fee for r in pay_q.filter(PaymentData.sheet_category.ilike('%Deposit'))),
-        'Tier Fee Withdraw': sum(r.tier_fee for r in pay_q.filter(PaymentData.sheet_category.ilike('%Withdraw')))
-    }
-
-    # Welcome bonus
-    welcome_ids = [a.login for a in AccountList.query.filter_by(
-        user_id=current_user.id, is_welcome_bonus=True
-    ).all()]
-    wb = 0
-    for w in crm_w_q.all():
-        m = re.search(r'\d+', w.trading_account or '')
-        if m and m.group() in welcome_ids:
-            wb += w.withdrawal_amount or 0
-    calc['Welcome Bonus Withdrawals'] = wb
-
-    # TopChange
-    tc = sum(d.trading_amount for d in crm_d_q.all()
-             if (d.payment_method or '').upper() == 'TOPCHANGE')
-    calc['CRM TopChange Total'] = tc
-
-    # build report rows
-    report = []
-    if start_date and end_date:
-        report.append(['Date Range', f"From {start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}"])
-        report.append(['',''])
-    for key, val in calc.items():
-        report.append([key, f"{val:.2f}"])
-    return report
-
-def generate_filtered_final_report(start_date, end_date):
-    # same as above, but using only filtered query sets
-    pay_q = filter_by_date_range(
-        PaymentData.query.filter_by(user_id=current_user.id),
-        start_date, end_date, PaymentData.created
-    )
-    rebate_q = filter_by_date_range(
-        IBRebate.query.filter_by(user_id=current_user.id),
-        start_date, end_date, IBRebate.rebate_time
-    )
-    crm_w_q = filter_by_date_range(
-        CRMWithdrawals.query.filter_by(user_id=current_user.id),
-        start_date, end_date, CRMWithdrawals.review_time
-    )
-    crm_d_q = filter_by_date_range(
-        CRMDeposit.query.filter_by(user_id=current_user.id),
-        start_date, end_date, CRMDeposit.request_time
-    )
-
-    report = []
-    report.append(['Filtered Date Range', f"From {start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}"])
-    report.append(['',''])
-    report.append(['Total Rebate', f"{sum_column(rebate_q.all(), 'rebate'):.2f}"])
-    report.append(['M2p Deposit', f"{sum(r.final_amount for r in pay_q.filter_by(sheet_category='M2p Deposit').all()):.2f}"])
-    report.append(['Settlement Deposit', f"{sum(r.final_amount for r in pay_q.filter_by(sheet_category='Settlement Deposit').all()):.2f}"])
-    report.append(['M2p Withdrawal', f"{sum(r.final_amount for r in pay_q.filter_by(sheet_category='M2p Withdraw').all()):.2f}"])
-    report.append(['Settlement Withdrawal', f"{sum(r.final_amount for r in pay_q.filter_by(sheet_category='Settlement Withdraw').all()):.2f}"])
-    report.append(['CRM Deposit Total', f"{sum_column(crm_d_q.all(), 'trading_amount'):.2f}"])
-    report.append(['TopChange Deposit Total',
-                   f"{sum(d.trading_amount for d in crm_d_q.all() if (d.payment_method or '').upper()=='TOPCHANGE'):.2f}"])
-    tf_dep = sum(r.tier_fee for r in pay_q.filter(PaymentData.sheet_category.ilike('%Deposit')))
-    tf_wdr = sum(r.tier_fee for r in pay_q.filter(PaymentData.sheet_category.ilike('%Withdraw')))
-    report.append(['Tier Fee Deposit', f"{tf_dep:.2f}"])
-    report.append(['Tier Fee Withdraw', f"{tf_wdr:.2f}"])
-    # Welcome bonus
-    welcome_ids = [a.login for a in AccountList.query.filter_by(user_id=current_user.id, is_welcome_bonus=True).all()]
-    wb = 0
-    for w in crm_w_q.all():
-        m = re.search(r'\d+', w.trading_account or '')
-        if m and m.group() in welcome_ids:
-            wb += w.withdrawal_amount or 0
-    report.append(['Welcome Bonus Withdrawals', f"{wb:.2f}"])
-    report.append(['CRM Withdraw Total', f"{sum_column(crm_w_q.all(), 'withdrawal_amount'):.2f}"])
-    return report
-
-def compare_deposits(start_date=None, end_date=None):
-    """Implement deposit vs CRM deposit discrepancy logic here, if desired."""
-    pass
+import charset_normalizer
+import numpy as np
+import pandas as pd
+import re
+from datetime import datetime
+from sqlalchemy import and_, func
+from app import db
+from app.models import (
+    PaymentData,
+    IBRebate,
+    CRMWithdrawals,
+    CRMDeposit,
+    AccountList
+)
+from flask_login import current_user
+
+# Login extraction pattern, compiled once at import time
+_LOGIN_RE = re.compile(r'\d+')
+
+# Everything except the characters of a signed decimal number
+_NON_NUMERIC_RE = re.compile(r'[^0-9.-]')
+
+# ──────── UTILITY FUNCTIONS ────────────────────────────────────────────────────
+
+def detect_separator(line: str) -> str:
+    # Single pass over the line instead of three str.count scans
+    counts = {'\t': 0, ',': 0, ';': 0}
+    for c in line:
+        if c in counts:
+            counts[c] += 1
+    if counts['\t'] >= counts[','] and counts['\t'] >= counts[';']:
+        return '\t'
+    if counts[';'] >= counts[',']:
+        return ';'
+    return ','
+
+# Supported date formats, tried in order
+_DATE_FORMATS = [
+    '%Y-%m-%d %H:%M:%S', '%Y-%m-%d',
+    '%d.%m.%Y %H:%M:%S', '%d.%m.%Y',
+    '%d/%m/%Y %H:%M:%S', '%d/%m/%Y',
+    '%m/%d/%Y %H:%M:%S', '%m/%d/%Y'
+]
+
+def parse_date(val, formats=None):
+    if val is None or (isinstance(val, float) and pd.isna(val)):
+        return None
+    s = str(val).strip()
+    for f in formats or _DATE_FORMATS:
+        try:
+            return datetime.strptime(s, f)
+        except ValueError:
+            continue
+    return None
+
+def parse_date_series(series):
+    """Parse a whole date column at once with pandas' cached C parser.
+
+    Each supported format is tried column-wise against the still-unparsed
+    cells, preserving parse_date's trial order; returns a list of
+    datetimes with None for unparseable cells.
+    """
+    values = series.astype(str).str.strip()
+    result = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    for fmt in _DATE_FORMATS:
+        mask = result.isna()
+        if not mask.any():
+            break
+        result.loc[mask] = pd.to_datetime(values[mask], format=fmt, errors='coerce', cache=True)
+    return [value.to_pydatetime() if value is not pd.NaT else None for value in result]
+
+def read_csv(filepath: str, usecols=None, chunksize=None):
+    """Pick the encoding from a small sample, then parse the file once.
+
+    usecols limits the parse to the named columns (matched after header
+    stripping); columns absent from the file are simply not returned.
+    With chunksize set an iterator of DataFrames is returned instead of
+    one frame, so large files never have to fit in memory at once.
+    """
+    with open(filepath, 'rb') as f:
+        sample = f.read(65536)
+    if sample.startswith(b'\xef\xbb\xbf'):
+        enc = 'utf-8-sig'
+    elif sample.startswith((b'\xff\xfe', b'\xfe\xff')):
+        enc = 'utf-16'
+    else:
+        try:
+            sample.decode('utf-8')
+            enc = 'utf-8'
+        except UnicodeDecodeError:
+            best = charset_normalizer.from_bytes(sample).best()
+            enc = best.encoding if best is not None else 'cp1252'
+    first = sample.decode(enc, errors='replace').splitlines()[0] if sample else ''
+    sep = detect_separator(first)
+    if usecols is not None:
+        wanted = set(usecols)
+        return pd.read_csv(filepath, sep=sep, encoding=enc, engine='c',
+                           usecols=lambda c: str(c).strip() in wanted,
+                           chunksize=chunksize)
+    return pd.read_csv(filepath, sep=sep, encoding=enc, engine='c',
+                       chunksize=chunksize)
+
+def filter_unique(rows, existing_keys: set, key_cols: list):
+    """Mimic the Apps Script filterUnique: keep rows whose key (join of cols) is new."""
+    unique = []
+    for row in rows:
+        key = '|'.join(str(row[i] if i < len(row) else '').strip().upper() for i in key_cols)
+        if key and key not in existing_keys:
+            existing_keys.add(key)
+            unique.append(row)
+    return unique
+
+# ──────── STAGE 1: DATA PROCESSING ───────────────────────────────────────────────
+
+# Column mapping for PaymentData
+_COLUMN_MAP = {
+    'confirmed':'Confirmed','txId':'Transaction ID',
+    'transactionAddress':'Wallet address','status':'Status','type':'Type',
+    'paymentGatewayName':'Payment gateway','finalAmount':'Transaction amount',
+    'finalCurrency':'Transaction currency','transactionAmount':'Settlement amount',
+    'transactionCurrencyDisplayName':'Settlement currency','processingFee':'Processing fee',
+    'price':'Price','comment':'Comment','paymentId':'Payment ID','created':'Booked',
+    'tradingAccount':'Trading account','correctCoinSent':'correctCoinSent',
+    'balanceAfterTransaction':'Balance after','tierFee':'Tier fee'
+}
+_SHEET_CATEGORIES = {
+    'DEPOSIT': ('M2p Deposit','Settlement Deposit'),
+    'WITHDRAW': ('M2p Withdraw','Settlement Withdraw')
+}
+# Rows parsed and inserted per chunk; keeps the working set to one chunk
+_CHUNK_ROWS = 10_000
+
+def process_payment(filepath: str) -> int:
+    uid = current_user.id
+    existing = set()
+    added = 0
+    # Stream the file chunk by chunk so RSS is bounded by one chunk
+    for df in read_csv(filepath, usecols=_COLUMN_MAP.values(), chunksize=_CHUNK_ROWS):
+        if df.empty:
+            continue
+        df = df.rename(columns=lambda c: str(c).strip())
+
+        def column(key, default=''):
+            header = _COLUMN_MAP[key]
+            if header in df.columns:
+                return df[header]
+            return pd.Series(default, index=df.index)
+
+        # Vectorized normalization and filtering instead of per-row str() work
+        tx = column('txId').astype(str).str.strip()
+        status = column('status').astype(str).str.upper()
+        pg = column('paymentGatewayName').astype(str).str.upper()
+        ty = column('type').astype(str).str.upper()
+        mask = (tx != '') & (pg != 'BALANCE') & (status == 'DONE')
+
+        settlement = pg.str.contains('SETTLEMENT', regex=False)
+        categories = pd.Series(np.select(
+            [(ty == 'DEPOSIT') & settlement, ty == 'DEPOSIT', (ty == 'WITHDRAW') & settlement],
+            [_SHEET_CATEGORIES['DEPOSIT'][1], _SHEET_CATEGORIES['DEPOSIT'][0], _SHEET_CATEGORIES['WITHDRAW'][1]],
+            default=_SHEET_CATEGORIES['WITHDRAW'][0]
+        ), index=df.index)
+
+        # Date columns parsed in one vectorized pass each
+        confirmed_dates = pd.Series(parse_date_series(column('confirmed')), index=df.index, dtype=object)
+        created_dates = pd.Series(parse_date_series(column('created')), index=df.index, dtype=object)
+
+        # One query per chunk replaces the per-row existence probe
+        candidates = [t for t in tx[mask].unique().tolist() if t not in existing]
+        if candidates:
+            existing.update(t for (t,) in db.session.query(PaymentData.tx_id).filter(
+                PaymentData.user_id == uid,
+                PaymentData.tx_id.in_(candidates)
+            ))
+
+        records = []
+        kept = df.index[mask]
+        for idx, data in zip(kept, df.loc[kept].to_dict('records')):
+            t = tx.at[idx]
+            if t in existing:
+                continue
+            existing.add(t)
+            records.append({
+                'user_id': uid,
+                'confirmed': confirmed_dates.at[idx],
+                'tx_id': t,
+                'wallet_address': data.get(_COLUMN_MAP['transactionAddress']),
+                'status': status.at[idx],
+                'type': ty.at[idx],
+                'payment_gateway': data.get(_COLUMN_MAP['paymentGatewayName']),
+                'final_amount': float(data.get(_COLUMN_MAP['finalAmount']) or 0),
+                'final_currency': data.get(_COLUMN_MAP['finalCurrency']),
+                'settlement_amount': float(data.get(_COLUMN_MAP['transactionAmount']) or 0),
+                'settlement_currency': data.get(_COLUMN_MAP['transactionCurrencyDisplayName']),
+                'processing_fee': float(data.get(_COLUMN_MAP['processingFee']) or 0),
+                'price': float(data.get(_COLUMN_MAP['price']) or 1),
+                'comment': data.get(_COLUMN_MAP['comment']),
+                'payment_id': data.get(_COLUMN_MAP['paymentId']),
+                'created': created_dates.at[idx],
+                'trading_account': data.get(_COLUMN_MAP['tradingAccount']),
+                'correct_coin_sent': True,
+                'balance_after': float(data.get(_COLUMN_MAP['balanceAfterTransaction']) or 0),
+                'tier_fee': float(data.get(_COLUMN_MAP['tierFee']) or 0),
+                'sheet_category': categories.at[idx]
+            })
+
+        if records:
+            # One executemany INSERT per chunk instead of one statement per record
+            db.session.execute(PaymentData.__table__.insert(), records)
+            db.session.flush()
+            added += len(records)
+    db.session.commit()
+    return added
+
+def process_ib_rebate(filepath: str) -> int:
+    uid = current_user.id
+    # One query loads the user's existing keys; the set also dedupes
+    # rows within and across chunks
+    existing = {k for (k,) in db.session.query(IBRebate.transaction_id).filter_by(user_id=uid)}
+    added = 0
+    for df in read_csv(filepath, usecols=('Transaction ID', 'Rebate', 'Rebate Time'),
+                       chunksize=_CHUNK_ROWS):
+        rebate_times = (parse_date_series(df['Rebate Time'])
+                        if 'Rebate Time' in df.columns else [None] * len(df))
+        records = []
+        # Dict rows avoid iterrows' per-row Series construction
+        for row, rebate_time in zip(df.to_dict('records'), rebate_times):
+            tx = str(row.get('Transaction ID','')).strip()
+            if not tx or tx in existing:
+                continue
+            existing.add(tx)
+            records.append({
+                'user_id': uid,
+                'transaction_id': tx,
+                'rebate': float(row.get('Rebate',0) or 0),
+                'rebate_time': rebate_time
+            })
+        if records:
+            db.session.execute(IBRebate.__table__.insert(), records)
+            db.session.flush()
+            added += len(records)
+    db.session.commit()
+    return added
+
+def process_crm_withdrawals(filepath: str) -> int:
+    uid = current_user.id
+    # One query loads the user's existing keys; the set also dedupes
+    # rows within and across chunks
+    existing = {k for (k,) in db.session.query(CRMWithdrawals.request_id).filter_by(user_id=uid)}
+    added = 0
+    for df in read_csv(filepath, usecols=('Request ID', 'Review Time', 'Trading Account', 'Withdrawal Amount'),
+                       chunksize=_CHUNK_ROWS):
+        review_times = (parse_date_series(df['Review Time'])
+                        if 'Review Time' in df.columns else [None] * len(df))
+        records = []
+        for row, review_time in zip(df.to_dict('records'), review_times):
+            req = str(row.get('Request ID','')).strip()
+            if not req or req in existing:
+                continue
+            existing.add(req)
+            amt_raw = str(row.get('Withdrawal Amount','')).upper()
+            if 'USC' in amt_raw:
+                amt = float(_NON_NUMERIC_RE.sub('', amt_raw)) / 100
+            else:
+                amt = float(_NON_NUMERIC_RE.sub('', amt_raw) or 0)
+            records.append({
+                'user_id': uid,
+                'request_id': req,
+                'review_time': review_time,
+                'trading_account': str(row.get('Trading Account','')).strip(),
+                'withdrawal_amount': amt
+            })
+        if records:
+            db.session.execute(CRMWithdrawals.__table__.insert(), records)
+            db.session.flush()
+            added += len(records)
+    db.session.commit()
+    return added
+
+def process_crm_deposit(filepath: str) -> int:
+    uid = current_user.id
+    # One query loads the user's existing keys; the set also dedupes
+    # rows within and across chunks
+    existing = {k for (k,) in db.session.query(CRMDeposit.request_id).filter_by(user_id=uid)}
+    added = 0
+    for df in read_csv(filepath, usecols=('Request ID', 'Request Time', 'Trading Account', 'Trading Amount', 'Payment Method', 'Client ID', 'Name'),
+                       chunksize=_CHUNK_ROWS):
+        request_times = (parse_date_series(df['Request Time'])
+                         if 'Request Time' in df.columns else [None] * len(df))
+        records = []
+        for row, request_time in zip(df.to_dict('records'), request_times):
+            req = str(row.get('Request ID','')).strip()
+            if not req or req in existing:
+                continue
+            existing.add(req)
+            amt_raw = str(row.get('Trading Amount',''))
+            if 'USC' in amt_raw.upper():
+                parts = amt_raw.split()
+                num = _NON_NUMERIC_RE.sub('', parts[1] if len(parts)>1 else '0')
+                amt = float(num) / 100
+            else:
+                amt = float(_NON_NUMERIC_RE.sub('', amt_raw) or 0)
+            records.append({
+                'user_id': uid,
+                'request_id': req,
+                'request_time': request_time,
+                'trading_account': str(row.get('Trading Account','')).strip(),
+                'trading_amount': amt,
+                'payment_method': row.get('Payment Method',''),
+                'client_id': row.get('Client ID',''),
+                'name': row.get('Name','')
+            })
+        if records:
+            db.session.execute(CRMDeposit.__table__.insert(), records)
+            db.session.flush()
+            added += len(records)
+    db.session.commit()
+    return added
+
+def process_account_list(filepath: str) -> int:
+    df = read_csv(filepath)
+    # remove first METATRADER line if present
+    if 'METATRADER' in df.iloc[0,0].upper():
+        df = df.iloc[1:]
+    # clear previous
+    uid = current_user.id
+    AccountList.query.filter_by(user_id=uid).delete()
+    records = []
+    for row in df.to_dict('records'):
+        login = str(row.get('Login','')).strip()
+        if not login:
+            continue
+        grp = str(row.get('Group','')).strip()
+        records.append({
+            'user_id': uid,
+            'login': login,
+            'name': row.get('Name',''),
+            'group': grp,
+            'is_welcome_bonus': (grp == r'WELCOME\Welcome BBOOK')
+        })
+    if records:
+        db.session.execute(AccountList.__table__.insert(), records)
+    db.session.commit()
+    return len(records)
+
+# ──────── STAGE 2: REPORT GENERATION ────────────────────────────────────────────
+
+def filter_by_date_range(query, start_date, end_date, column):
+    if start_date and end_date:
+        return query.filter(and_(column >= start_date, column <= end_date))
+    return query
+
+def sum_column(query, column):
+    """Sum a column in SQL; returns one scalar instead of fetching rows."""
+    return query.with_entities(func.coalesce(func.sum(column), 0)).scalar()
+
+def _calculate_metrics(start_date=None, end_date=None):
+    """Shared metric computation for both report variants"""
+    uid = current_user.id
+
+    # One GROUP BY scan replaces the four per-category SELECTs plus the
+    # two ilike tier-fee passes over the same rows
+    pay_q = filter_by_date_range(
+        db.session.query(
+            PaymentData.sheet_category,
+            func.sum(PaymentData.final_amount),
+            func.sum(PaymentData.tier_fee)
+        ).filter(PaymentData.user_id == uid).group_by(PaymentData.sheet_category),
+        start_date, end_date, PaymentData.created
+    )
+    amounts, tier_fees = {}, {}
+    for category, amount, fee in pay_q:
+        amounts[category] = amount or 0
+        tier_fees[category] = fee or 0
+
+    rebate_q = filter_by_date_range(
+        db.session.query(func.sum(IBRebate.rebate)).filter(IBRebate.user_id == uid),
+        start_date, end_date, IBRebate.rebate_time
+    )
+    crm_w_q = filter_by_date_range(
+        db.session.query(CRMWithdrawals.trading_account, CRMWithdrawals.withdrawal_amount)
+        .filter(CRMWithdrawals.user_id == uid),
+        start_date, end_date, CRMWithdrawals.review_time
+    )
+    crm_d_q = filter_by_date_range(
+        db.session.query(CRMDeposit.trading_amount, CRMDeposit.payment_method)
+        .filter(CRMDeposit.user_id == uid),
+        start_date, end_date, CRMDeposit.request_time
+    )
+
+    # A single walk over the deposits yields both the total and the
+    # TopChange subtotal
+    crm_dep_total = tc = 0
+    for amount, method in crm_d_q:
+        amount = amount or 0
+        crm_dep_total += amount
+        if (method or '').upper() == 'TOPCHANGE':
+            tc += amount
+
+    # Likewise one walk over the withdrawals covers the total and the
+    # welcome-bonus subtotal
+    welcome_ids = {login for (login,) in db.session.query(AccountList.login)
+                   .filter_by(user_id=uid, is_welcome_bonus=True)}
+    crm_wd_total = wb = 0
+    for account, amount in crm_w_q:
+        amount = amount or 0
+        crm_wd_total += amount
+        m = _LOGIN_RE.search(account) if account else None
+        if m and m.group() in welcome_ids:
+            wb += amount
+
+    calc = {
+        'Total Rebate':      rebate_q.scalar() or 0,
+        'M2p Deposit':       amounts.get('M2p Deposit', 0),
+        'Settlement Deposit':amounts.get('Settlement Deposit', 0),
+        'M2p Withdrawal':    amounts.get('M2p Withdraw', 0),
+        'Settlement Withdrawal':amounts.get('Settlement Withdraw', 0),
+        'CRM Deposit Total': crm_dep_total,
+        'CRM Withdraw Total':crm_wd_total,
+        'Tier Fee Deposit':  tier_fees.get('M2p Deposit', 0) + tier_fees.get('Settlement Deposit', 0),
+        'Tier Fee Withdraw': tier_fees.get('M2p Withdraw', 0) + tier_fees.get('Settlement Withdraw', 0)
+    }
+    calc['Welcome Bonus Withdrawals'] = wb
+    calc['CRM TopChange Total'] = tc
+    return calc
+
+def generate_final_report(start_date=None, end_date=None):
+    calc = _calculate_metrics(start_date, end_date)
+    report = []
+    if start_date and end_date:
+        report.append(['Date Range', f"From {start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}"])
+        report.append(['',''])
+    for key, val in calc.items():
+        report.append([key, f"{val:.2f}"])
+    return report
+
+def generate_filtered_final_report(start_date, end_date):
+    # Same metrics as generate_final_report, presented in the filtered
+    # layout with the TopChange subtotal inline
+    calc = _calculate_metrics(start_date, end_date)
+    report = []
+    report.append(['Filtered Date Range', f"From {start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}"])
+    report.append(['',''])
+    for key in ('Total Rebate', 'M2p Deposit', 'Settlement Deposit',
+                'M2p Withdrawal', 'Settlement Withdrawal', 'CRM Deposit Total'):
+        report.append([key, f"{calc[key]:.2f}"])
+    report.append(['TopChange Deposit Total', f"{calc['CRM TopChange Total']:.2f}"])
+    report.append(['Tier Fee Deposit', f"{calc['Tier Fee Deposit']:.2f}"])
+    report.append(['Tier Fee Withdraw', f"{calc['Tier Fee Withdraw']:.2f}"])
+    report.append(['Welcome Bonus Withdrawals', f"{calc['Welcome Bonus Withdrawals']:.2f}"])
+    report.append(['CRM Withdraw Total', f"{calc['CRM Withdraw Total']:.2f}"])
+    return report
+
+def compare_deposits(start_date=None, end_date=None):
+    """Implement deposit vs CRM deposit discrepancy logic here, if desired."""
+    pass